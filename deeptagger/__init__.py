@@ -29,6 +29,33 @@ __email__ = 'marcostreviso@usp.br'
 __license__ = 'MIT'
 __copyright__ = 'Copyright 2019 Marcos Treviso'
 
-from .predicter import Predicter  # NOQA
-from .tagger import Tagger  # NOQA
-from .trainer import Trainer  # NOQA
+import sys
+
+# these classes depend on torch, so they are only imported when accessed
+_lazy_attributes = {
+    'Predicter': 'deeptagger.predicter.Predicter',
+    'Tagger': 'deeptagger.tagger.Tagger',
+    'TaggerPool': 'deeptagger.pool.TaggerPool',
+    'TaggerRegistry': 'deeptagger.registry.TaggerRegistry',
+    'Trainer': 'deeptagger.trainer.Trainer',
+}
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name not in _lazy_attributes:
+            raise AttributeError("module {!r} has no attribute {!r}".format(
+                __name__, name))
+        from deeptagger.lazy import import_object
+        value = import_object(_lazy_attributes[name])
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(globals()) | set(_lazy_attributes))
+else:
+    # module __getattr__ is not supported before python 3.7 (PEP 562)
+    from .predicter import Predicter  # NOQA
+    from .tagger import Tagger  # NOQA
+    from .pool import TaggerPool  # NOQA
+    from .registry import TaggerRegistry  # NOQA
+    from .trainer import Trainer  # NOQA
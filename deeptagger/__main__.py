@@ -4,16 +4,18 @@ from pprint import pformat
 
 from deeptagger import config_utils
 from deeptagger import opts
-from deeptagger import predict
-from deeptagger import train
 
 parser = argparse.ArgumentParser(description='DeepTagger')
-parser.add_argument('task', type=str, choices=['train', 'predict'])
+parser.add_argument('task', type=str,
+                    choices=['train', 'predict', 'quantize', 'bundle',
+                             'autotune', 'batch'])
 opts.general_opts(parser)
 opts.preprocess_opts(parser)
 opts.model_opts(parser)
 opts.train_opts(parser)
 opts.predict_opts(parser)
+opts.batch_opts(parser)
+opts.autotune_opts(parser)
 
 
 if __name__ == '__main__':
@@ -22,10 +24,27 @@ if __name__ == '__main__':
     config_utils.configure_logger(options.debug, options.output_dir)
     config_utils.configure_seed(options.seed)
     config_utils.configure_device(options.gpu_id)
+    config_utils.configure_threads(options.num_threads,
+                                   options.num_interop_threads)
 
+    # only the modules needed by the task are imported
     if options.task == 'train':
         logging.info('Running options:\n{}'.format(pformat(vars(options))))
         logging.info('Output directory is: {}'.format(options.output_dir))
+        from deeptagger import train
         train.run(options)
     elif options.task == 'predict':
+        from deeptagger import predict
         predict.run(options)
+    elif options.task == 'quantize':
+        from deeptagger import quantize
+        quantize.run(options)
+    elif options.task == 'bundle':
+        from deeptagger import bundle
+        bundle.run(options)
+    elif options.task == 'autotune':
+        from deeptagger import autotune
+        autotune.run(options)
+    elif options.task == 'batch':
+        from deeptagger import batch
+        batch.run(options)
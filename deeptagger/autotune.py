@@ -0,0 +1,213 @@
+import itertools
+import json
+import logging
+import os
+import platform
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from deeptagger import constants
+
+
+def config_path(model_path):
+    """Path of the autotuned config of a model saved in `model_path`. It is
+    saved inside model directories, and next to bundle files."""
+    model_path = Path(model_path)
+    if model_path.is_dir():
+        return model_path / constants.AUTOTUNE
+    return model_path.with_suffix('.' + constants.AUTOTUNE)
+
+
+def load_config(model_path):
+    """Return the recommended config (a dict with `batch_size`,
+    `num_threads` and `num_workers`) saved by `run` for the model in
+    `model_path`, or None if the model was not autotuned."""
+    path = config_path(model_path)
+    if not path.exists():
+        return None
+    with open(str(path), 'r') as f:
+        return json.load(f)
+
+
+def default_sweep(max_value):
+    # powers of two up to max_value (included)
+    values = [2 ** i for i in range(max_value.bit_length())]
+    if values[-1] != max_value:
+        values.append(max_value)
+    return values
+
+
+def read_texts(path, options, max_sentences):
+    from deeptagger.dataset.corpus import Corpus
+    corpus = Corpus([('words', None)], options.del_word, options.del_tag)
+    lines = itertools.islice(Corpus.iter_lines(path), max_sentences)
+    corpus.add_tagged_texts(lines)
+    return corpus.fields_examples[0]
+
+
+def measure(predict_fn, texts, batch_size, nb_clients):
+    """Send `texts` in requests of `batch_size` sentences from `nb_clients`
+    concurrent clients and measure the latency of each request.
+
+    Returns:
+        dict with the throughput (sentences and tokens per second) and the
+        p50 and p99 latencies (in milliseconds)
+    """
+    requests = [texts[i:i + batch_size]
+                for i in range(0, len(texts), batch_size)]
+    latencies = []
+    lock = threading.Lock()
+
+    def client(client_requests):
+        for request in client_requests:
+            start = time.perf_counter()
+            predict_fn(request, batch_size)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    clients = [threading.Thread(target=client,
+                                args=(requests[i::nb_clients],))
+               for i in range(nb_clients)]
+    start = time.perf_counter()
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    elapsed = time.perf_counter() - start
+
+    nb_tokens = sum(len(text.split()) for text in texts)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'sentences_per_sec': len(texts) / elapsed,
+        'tokens_per_sec': nb_tokens / elapsed,
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+    }
+
+
+def sweep(tagger, texts, batch_sizes, combinations):
+    """Measure each batch size with each (number of workers, number of
+    threads per worker) in `combinations`. A single worker runs in this
+    process, while more workers are forked in a `TaggerPool`, each one
+    receiving requests from its own client.
+
+    Workers are forked before running anything on several threads in this
+    process, since forking after that hangs with GNU OpenMP."""
+    import torch
+    from deeptagger.pool import TaggerPool
+
+    initial_threads = torch.get_num_threads()
+    results = []
+    try:
+        for nb_workers, nb_threads in sorted(combinations, reverse=True):
+            pool = None
+            if nb_workers > 1:
+                pool = TaggerPool(tagger, nb_workers, num_threads=nb_threads,
+                                  warmup=False)
+                predict_fn = pool.predict_classes
+            else:
+                torch.set_num_threads(nb_threads)
+                predict_fn = tagger.predict_classes
+            try:
+                for batch_size in batch_sizes:
+                    # first run to warm up the shapes of this batch size
+                    predict_fn(texts[:batch_size], batch_size)
+                    result = measure(predict_fn, texts, batch_size,
+                                     nb_workers)
+                    result.update(batch_size=batch_size,
+                                  num_threads=nb_threads,
+                                  num_workers=nb_workers)
+                    logging.info(
+                        'workers: {num_workers} threads: {num_threads} '
+                        'batch size: {batch_size} -> '
+                        '{sentences_per_sec:.1f} sent/s '
+                        '{tokens_per_sec:.1f} tok/s '
+                        'p50: {p50_ms:.2f}ms p99: {p99_ms:.2f}ms'.format(
+                            **result))
+                    results.append(result)
+            finally:
+                if pool is not None:
+                    pool.close()
+    finally:
+        torch.set_num_threads(initial_threads)
+    return results
+
+
+def recommend(results, max_p99=None):
+    """Pick the configuration with the highest throughput, among those with
+    a p99 latency below `max_p99` (in milliseconds) if it is given."""
+    candidates = results
+    if max_p99 is not None:
+        candidates = [r for r in results if r['p99_ms'] <= max_p99]
+        if not candidates:
+            logging.warning('No configuration has a p99 latency below '
+                            '{}ms, ignoring the constraint.'.format(max_p99))
+            candidates = results
+    return max(candidates, key=lambda r: r['sentences_per_sec'])
+
+
+def run(options):
+    from deeptagger.tagger import Tagger
+
+    if options.load is None:
+        raise Exception('You should inform a path to a trained model.')
+
+    if options.test_path is None:
+        raise Exception('You should inform a path to sample data.')
+
+    workers = options.autotune_workers
+    threads = options.autotune_threads
+    cpu_count = os.cpu_count() or 1
+    if options.gpu_id is not None:
+        if workers is not None and workers != [1]:
+            raise Exception('Multiple workers are only available on CPU.')
+        workers = [1]
+    if workers is None:
+        workers = default_sweep(cpu_count)
+    if threads is None:
+        threads = default_sweep(cpu_count)
+
+    logging.info('Loading model...')
+    tagger = Tagger(gpu_id=options.gpu_id)
+    tagger.load(options.load, quantize=options.quantize, inference=True,
+                use_autotune=False)
+
+    logging.info('Reading sample: {}'.format(options.test_path))
+    texts = read_texts(options.test_path, options,
+                       options.autotune_max_sentences)
+    if not texts:
+        raise Exception('The sample data is empty.')
+
+    combinations = list(itertools.product(workers, threads))
+    # unless both lists were given, skip combinations that would use more
+    # threads than cpus
+    if options.autotune_workers is None or options.autotune_threads is None:
+        combinations = [(w, t) for w, t in combinations if w * t <= cpu_count]
+
+    logging.info('Sweeping {} batch sizes and {} worker/thread counts on {} '
+                 'sentences...'.format(len(options.autotune_batch_sizes),
+                                       len(combinations), len(texts)))
+    results = sweep(tagger, texts, options.autotune_batch_sizes,
+                    combinations)
+
+    best = recommend(results, options.autotune_max_p99)
+    config = {
+        'batch_size': best['batch_size'],
+        'num_threads': best['num_threads'],
+        'num_workers': best['num_workers'],
+        'measured': best,
+        'host': {'cpu_count': cpu_count,
+                 'machine': platform.machine(),
+                 'gpu_id': options.gpu_id},
+        'results': results,
+    }
+    path = config_path(options.load)
+    with open(str(path), 'w') as f:
+        json.dump(config, f, indent=4)
+    logging.info('Recommended: batch size {batch_size}, {num_threads} '
+                 'threads, {num_workers} workers'.format(**config))
+    logging.info('Autotuned config saved in {}'.format(path))
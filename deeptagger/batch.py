@@ -0,0 +1,255 @@
+import glob
+import itertools
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from torchtext.data import Dataset
+
+from deeptagger import cache
+from deeptagger import constants
+from deeptagger.dataset import dataset
+from deeptagger.dataset.corpus import Corpus
+from deeptagger import predict
+from deeptagger import writer
+
+
+def run(options):
+    if options.load is None:
+        raise Exception('You should inform a path to a trained model.')
+
+    if options.input is None:
+        raise Exception('You should inform an input directory or a glob '
+                        'pattern.')
+
+    predict.configure_autotune(options)
+
+    root, files = find_files(options.input, exclude=options.output_dir)
+    manifest = Manifest(Path(options.output_dir, constants.MANIFEST))
+    jobs = []
+    for path in files:
+        name = str(path.relative_to(root))
+        output_exists = Path(options.output_dir, name).exists()
+        if not (output_exists and manifest.is_done(name, path)):
+            jobs.append((path, name))
+    logging.info('{} files found in {}, {} already tagged'.format(
+        len(files), options.input, len(files) - len(jobs)))
+
+    # top-k tags are drawn from the probabilities
+    if options.output_format == 'topk':
+        options.prediction_type = 'probas'
+
+    fields_tuples, model = predict.load_model(options)
+    tags_field = dict(fields_tuples)['tags']
+    test_tuples = list(filter(lambda x: x[0] != 'tags', fields_tuples))
+    prediction_cache = predict.open_cache(options, fields_tuples, model)
+    batcher = Batcher(options, model, prediction_cache)
+
+    try:
+        with ThreadPoolExecutor(options.concurrent_files) as executor:
+            futures = {}
+            for path, name in jobs:
+                future = executor.submit(tag_file, options, test_tuples,
+                                         tags_field, batcher, manifest,
+                                         path, name)
+                futures[future] = name
+            try:
+                for i, future in enumerate(as_completed(futures), start=1):
+                    future.result()
+                    logging.info('[{}/{}] {}'.format(i, len(jobs),
+                                                     futures[future]))
+            except BaseException:
+                # files that were not started are left for the next run
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        batcher.close()
+        manifest.close()
+        if prediction_cache is not None:
+            prediction_cache.close()
+    logging.info('Predictions saved in {}'.format(options.output_dir))
+
+
+def find_files(path, exclude=None):
+    """Find the files inside a directory (recursively) or matching a glob
+    pattern, ignoring the ones inside `exclude`.
+
+    Returns:
+        the root directory of the files, which is used to name the outputs
+        after the relative path of each file, and the sorted list of files
+    """
+    if Path(path).is_dir():
+        root = Path(path)
+        files = [p for p in root.rglob('*') if p.is_file()]
+    else:
+        files = [Path(p) for p in glob.glob(path, recursive=True)
+                 if Path(p).is_file()]
+        root = Path('.')
+        if files:
+            root = Path(os.path.commonpath([str(p.parent) for p in files]))
+    if exclude is not None:
+        exclude = Path(exclude).resolve()
+        files = [p for p in files if exclude not in p.resolve().parents]
+    return root, sorted(files)
+
+
+def tag_file(options, fields_tuples, tags_field, batcher, manifest, path,
+             name):
+    """Tag a file in chunks of `options.chunk_size` sentences and save its
+    predictions in the directory `options.output_dir/name`.
+
+    Predictions are written to a temporary directory that is renamed when
+    the file is done, so an interrupted job never leaves partial outputs.
+    """
+    output_dir = Path(options.output_dir, name)
+    tmp_dir = output_dir.with_name(output_dir.name + '.tmp')
+    if tmp_dir.exists():
+        shutil.rmtree(str(tmp_dir))
+
+    nb_sentences = 0
+    lines = Corpus.iter_lines(str(path))
+    with writer.build(options, tags_field, str(tmp_dir)) as w:
+        while True:
+            chunk = list(itertools.islice(lines, options.chunk_size))
+            if not chunk:
+                break
+            chunk_dataset = dataset.build_tagged_texts(chunk, fields_tuples,
+                                                       options)
+            predictions = batcher.predict(chunk_dataset)
+            w.write(chunk, cache.format_predictions(predictions,
+                                                    w.return_type))
+            nb_sentences += len(chunk)
+
+    if output_dir.exists():
+        shutil.rmtree(str(output_dir))
+    os.replace(str(tmp_dir), str(output_dir))
+    manifest.add(name, path, nb_sentences)
+
+
+class Batcher:
+    """Predict datasets sent by several threads in shared batches.
+
+    Datasets waiting to be predicted are merged (up to
+    `options.chunk_size` examples), so the sentences of small files still
+    fill up length-sorted batches, and the model runs in a single thread.
+    """
+
+    def __init__(self, options, model, prediction_cache=None):
+        self.options = options
+        self.model = model
+        self.prediction_cache = prediction_cache
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='batcher',
+                                       daemon=True)
+        self.thread.start()
+
+    def predict(self, text_dataset):
+        """Return a list with the predictions of each example (see
+        `predict.predict_dataset`)."""
+        future = Future()
+        self.requests.put((text_dataset, future))
+        return future.result()
+
+    def close(self):
+        self.requests.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            requests = [request]
+            nb_examples = len(request[0])
+            while nb_examples < self.options.chunk_size:
+                try:
+                    request = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    # stop after predicting what was already received
+                    self.requests.put(None)
+                    break
+                requests.append(request)
+                nb_examples += len(request[0])
+            self._predict(requests)
+
+    def _predict(self, requests):
+        first_dataset = requests[0][0]
+        examples = [ex for text_dataset, _ in requests
+                    for ex in text_dataset.examples]
+        merged = Dataset(examples, list(first_dataset.fields.items()))
+        merged.sort_key = first_dataset.sort_key
+        try:
+            predictions = predict.predict_dataset(self.options, merged,
+                                                  self.model,
+                                                  self.prediction_cache)
+        except Exception as e:
+            for _, future in requests:
+                future.set_exception(e)
+            return
+        start = 0
+        for text_dataset, future in requests:
+            end = start + len(text_dataset)
+            future.set_result(predictions[start:end])
+            start = end
+
+
+class Manifest:
+    """Progress of a batch job, saved as one json line per tagged file.
+
+    Entries hold the size and modification time of each input, so files
+    changed after being tagged are tagged again.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.entries = {}
+        last_line = '\n'
+        if self.path.exists():
+            with open(str(self.path), 'r', encoding='utf8') as f:
+                for line in f:
+                    last_line = line
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # line partially written by an interrupted job
+                        continue
+                    self.entries[entry['path']] = entry
+        self._lock = threading.Lock()
+        self.file = open(str(self.path), 'a', encoding='utf8')
+        if not last_line.endswith('\n'):
+            self.file.write('\n')
+
+    @staticmethod
+    def stat(path):
+        stat = Path(path).stat()
+        return stat.st_size, stat.st_mtime_ns
+
+    def is_done(self, name, path):
+        entry = self.entries.get(name)
+        if entry is None:
+            return False
+        return (entry['size'], entry['mtime_ns']) == self.stat(path)
+
+    def add(self, name, path, nb_sentences):
+        size, mtime_ns = self.stat(path)
+        entry = {'path': name,
+                 'size': size,
+                 'mtime_ns': mtime_ns,
+                 'sentences': nb_sentences}
+        with self._lock:
+            self.entries[name] = entry
+            self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
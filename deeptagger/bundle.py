@@ -0,0 +1,160 @@
+import json
+import logging
+import struct
+from argparse import Namespace
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from deeptagger.dataset import fields
+from deeptagger.dataset.vocabulary import Vocabulary
+from deeptagger import features
+from deeptagger import models
+from deeptagger import opts
+
+# A bundle is a single file with the following layout:
+#
+#   magic (8 bytes) | version (4 bytes) | header length (8 bytes) |
+#   json header | padding | weights
+#
+# The json header holds the config options, the vocabulary of each field
+# and, for each weight, its name, dtype, shape and offset. Weights are raw
+# little-endian arrays aligned to `ALIGNMENT` bytes, so they can be mapped
+# directly into memory instead of being unpickled.
+MAGIC = b'DTBUNDLE'
+VERSION = 1
+ALIGNMENT = 64
+_prefix = struct.Struct('<8sIQ')
+
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def is_bundle(path):
+    path = Path(path)
+    if not path.is_file():
+        return False
+    with path.open('rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def save(path, options, fields_tuples, model):
+    if getattr(options, 'quantized', False):
+        raise Exception('Quantized models cant be bundled. Bundle the float '
+                        'model and quantize it after loading.')
+    arrays = []
+    tensors = []
+    offset = 0
+    for name, tensor in model.state_dict().items():
+        array = tensor.detach().cpu().contiguous().numpy()
+        array = array.astype(array.dtype.newbyteorder('<'), copy=False)
+        arrays.append((offset, array))
+        tensors.append([name, array.dtype.str, list(array.shape), offset])
+        offset = _align(offset + array.nbytes)
+    config = dict(vars(options))
+    config['gpu_id'] = None
+    header = {
+        'config': config,
+        'vocabs': [[name, field.vocab.itos] for name, field in fields_tuples],
+        'tensors': tensors,
+    }
+    header = json.dumps(header).encode('utf8')
+    data_start = _align(_prefix.size + len(header))
+    with open(str(path), 'wb') as f:
+        f.write(_prefix.pack(MAGIC, VERSION, len(header)))
+        f.write(header)
+        for tensor_offset, array in arrays:
+            f.seek(data_start + tensor_offset)
+            f.write(array.tobytes())
+        # make sure the file covers the padding of the last weight
+        f.truncate(data_start + offset)
+
+
+def read_header(path):
+    with open(str(path), 'rb') as f:
+        magic, version, header_length = _prefix.unpack(f.read(_prefix.size))
+        if magic != MAGIC:
+            raise Exception('{} is not a deeptagger bundle.'.format(path))
+        if version != VERSION:
+            raise Exception('Bundle version {} is not supported.'.format(
+                version))
+        header = json.loads(f.read(header_length).decode('utf8'))
+    header['data_start'] = _align(_prefix.size + header_length)
+    return header
+
+
+def load_weights(path, header):
+    """Map the weights of the bundle in `path` into tensors. The file is
+    mapped copy-on-write, so pages are read lazily and shared between
+    processes until they are written."""
+    buffer = np.memmap(str(path), dtype=np.uint8, mode='c')
+    state = {}
+    for name, dtype, shape, offset in header['tensors']:
+        dtype = np.dtype(dtype)
+        start = header['data_start'] + offset
+        nbytes = dtype.itemsize * int(np.prod(shape))
+        array = buffer[start:start + nbytes].view(dtype).reshape(shape)
+        state[name] = torch.from_numpy(array)
+    return state
+
+
+def load(path, fields_tuples, gpu_id=None):
+    """Load the options, vocabularies and model saved in a bundle. The
+    fields of the extra features are appended to `fields_tuples`.
+
+    The model is meant to be used for inference only: its parameters point
+    to the memory mapped weights, so no copy is made on CPU.
+    """
+    header = read_header(path)
+    options = Namespace(**header['config'])
+    fields_tuples += features.build(options)
+
+    vocabs = {name: Vocabulary(Counter(), specials=itos)
+              for name, itos in header['vocabs']}
+    fields.set_vocabs(fields_tuples, vocabs)
+
+    model = models.build(options, fields_tuples)
+    state = load_weights(path, header)
+    for name, tensor in model.state_dict(keep_vars=True).items():
+        if name not in state:
+            raise Exception('Weight {} not found in bundle.'.format(name))
+        if tensor.shape != state[name].shape:
+            raise Exception('Weight {} has shape {} in bundle but {} was '
+                            'expected.'.format(name, tuple(state[name].shape),
+                                               tuple(tensor.shape)))
+        tensor.data = state[name]
+    model.eval()
+
+    options.gpu_id = gpu_id
+    if gpu_id is not None:
+        model = model.cuda(gpu_id)
+    return options, model
+
+
+def run(options):
+    if options.load is None:
+        raise Exception('You should inform a path to a trained model.')
+
+    if options.save is None:
+        raise Exception('You should inform a path to save the bundle.')
+
+    words_field = fields.WordsField()
+    tags_field = fields.TagsField()
+    fields_tuples = [('words', words_field), ('tags', tags_field)]
+
+    model_options = opts.load(options.load)
+    model_options.gpu_id = None
+    fields_tuples += features.build(model_options)
+
+    logging.info('Loading vocabularies...')
+    fields.load_vocabs(options.load, fields_tuples)
+
+    logging.info('Loading model...')
+    model = models.load(options.load, fields_tuples, model_options)
+
+    logging.info('Saving bundle: {}'.format(options.save))
+    Path(options.save).parent.mkdir(parents=True, exist_ok=True)
+    save(options.save, model_options, fields_tuples, model)
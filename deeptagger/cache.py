@@ -0,0 +1,176 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from torchtext.data import Dataset
+
+from deeptagger import constants
+from deeptagger import iterator
+from deeptagger import models
+from deeptagger.predicter import Predicter
+
+
+def model_hash(model, fields_tuples):
+    """Hash of the weights of `model` and the vocabularies of its fields.
+    Two models with the same hash give the same predictions."""
+    digest = hashlib.sha256()
+    for name, tensor in models.state_tensors(model):
+        tensor = tensor.detach().cpu()
+        if getattr(tensor, 'is_quantized', False):
+            tensor = tensor.int_repr()
+        digest.update(name.encode('utf8'))
+        digest.update(str(tuple(tensor.shape)).encode('utf8'))
+        digest.update(tensor.contiguous().numpy().tobytes())
+    for name, field in fields_tuples:
+        digest.update(name.encode('utf8'))
+        digest.update('\n'.join(field.vocab.itos).encode('utf8'))
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """Persistent cache of the predictions of a model, stored in a sqlite
+    file inside `directory`.
+
+    Entries are addressed by the hash of the model, the prediction type and
+    the normalized sentence, so the same directory can be shared by several
+    models and a retrained model never reads stale predictions.
+    """
+
+    def __init__(self, directory, model_hash, nb_labels):
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self.path = Path(directory, constants.PREDICTIONS_CACHE)
+        self.model_hash = model_hash
+        self.nb_labels = nb_labels
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # the timeout lets several workers write to the same cache
+        self._db = sqlite3.connect(str(self.path), timeout=60,
+                                   check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS predictions '
+                         '(key BLOB PRIMARY KEY, value BLOB)')
+        self._db.commit()
+
+    def key(self, words, prediction_type):
+        content = '\n'.join([self.model_hash, prediction_type] + list(words))
+        return hashlib.sha256(content.encode('utf8')).digest()
+
+    def get_many(self, keys, prediction_type):
+        """Return a dict with the predictions found for `keys`."""
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            # sqlite limits the number of parameters of a query
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                query = 'SELECT key, value FROM predictions WHERE key IN ' \
+                        '({})'.format(','.join('?' * len(batch)))
+                for key, value in self._db.execute(query, batch):
+                    found[key] = self._decode(value, prediction_type)
+        return found
+
+    def put_many(self, predictions):
+        """Store a dict of key -> np.ndarray."""
+        rows = [(key, pred.tobytes()) for key, pred in predictions.items()]
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO predictions '
+                                 'VALUES (?, ?)', rows)
+            self._db.commit()
+
+    def _decode(self, value, prediction_type):
+        if prediction_type == 'classes':
+            return np.frombuffer(value, dtype=np.int64)
+        probas = np.frombuffer(value, dtype=np.float32)
+        return probas.reshape(-1, self.nb_labels)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class LRUCache:
+    """Thread-safe in-memory cache holding the `maxsize` most recently used
+    entries."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the entry for `key`, or None if it is not cached."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def predict(cache, text_dataset, model, prediction_type, batch_size,
+            device=None):
+    """Predict the examples of `text_dataset`, running the model only on
+    sentences that are not in `cache`. Identical sentences are predicted
+    only once.
+
+    Returns:
+        list of np.ndarray: predictions for each example, in dataset order
+    """
+    keys = [cache.key(ex.words, prediction_type)
+            for ex in text_dataset.examples]
+    found = cache.get_many(set(keys), prediction_type)
+    missing = {}
+    for key, ex in zip(keys, text_dataset.examples):
+        if key not in found and key not in missing:
+            missing[key] = ex
+    cache.hits += len(keys) - len(missing)
+    cache.misses += len(missing)
+    if missing:
+        fields_tuples = list(text_dataset.fields.items())
+        missing_dataset = Dataset(list(missing.values()), fields_tuples)
+        missing_dataset.sort_key = text_dataset.sort_key
+        dataset_iter = iterator.build_sorted(missing_dataset, device,
+                                             batch_size)
+        predictions = Predicter(dataset_iter, model).predict(prediction_type)
+        dtype = np.int64 if prediction_type == 'classes' else np.float32
+        new = {key: np.array(pred, dtype=dtype)
+               for key, pred in zip(missing.keys(), predictions)}
+        cache.put_many(new)
+        found.update(new)
+    logging.debug('Prediction cache: {} hits, {} misses'.format(
+        len(keys) - len(missing), len(missing)))
+    return [found[key] for key in keys]
+
+
+def format_predictions(predictions, return_type):
+    """Convert a list of arrays to the format of `Predicter.predict`."""
+    if return_type == 'numpy':
+        lengths = [len(pred) for pred in predictions]
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return np.concatenate(predictions), offsets
+    return [pred.tolist() for pred in predictions]
@@ -24,6 +24,19 @@ def configure_device(gpu_id):
         torch.cuda.set_device(gpu_id)
 
 
+def configure_threads(num_threads=None, num_interop_threads=None):
+    """Set the number of threads used inside an op (intra-op) and the
+    number of threads used to run independent ops (inter-op)."""
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads is not None:
+        if not hasattr(torch, 'set_num_interop_threads'):
+            raise Exception('Setting inter-op threads requires torch >= 1.2.')
+        # torch only allows setting it before any inter-op work has started
+        if torch.get_num_interop_threads() != num_interop_threads:
+            torch.set_num_interop_threads(num_interop_threads)
+
+
 def configure_logger(debug, output_dir):
     logging.Formatter.converter = time.gmtime
     logging.Formatter.default_msec_format = '%s.%03d'
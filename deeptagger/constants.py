@@ -8,10 +8,6 @@ STOP = '<eos>'
 UNK_ID = 0
 PAD_ID = 1
 
-# this should be set later after building fields
-TAGS_PAD_ID = 0
-NB_LABELS = 0
-
 # output_dir
 OUTPUT_DIR = 'runs'
 
@@ -24,3 +20,10 @@ SCHEDULER = 'scheduler.torch'
 TRAINER = 'trainer.torch'
 VOCAB = 'vocab.torch'
 PREDICTIONS = 'predictions.txt'
+PREDICTIONS_CONLL = 'predictions.conll'
+PREDICTIONS_NPY = 'predictions.npy'
+PREDICTIONS_NPZ = 'predictions.npz'
+OFFSETS_NPY = 'offsets.npy'
+PREDICTIONS_CACHE = 'predictions-cache.sqlite'
+MANIFEST = 'manifest.jsonl'
+AUTOTUNE = 'autotune.json'
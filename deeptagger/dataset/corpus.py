@@ -77,13 +77,16 @@ class Corpus:
         if 'caps' in self.attr_index:
             self.fields_examples[self.attr_index['caps']] = extract_caps(words)
 
-    def read(self, filepath):
+    def read(self, filepath, byte_range=None):
         """
         filepath: path to a file with the following format:
                   words are delimited by `delimiter_word` and
                   tags are delimited from words by `delimiter_tag`
                   e.g. The_ART princess_S is_V pretty_ADJ
                   where delimiter_word=' ' and delimiter_tag='_'
+        byte_range: a tuple (start, end) to read only the lines starting
+                    in the [start, end) byte interval. Useful to shard a
+                    big file. If None, the whole file is read.
         """
         # warning for two well known Brazilian Portuguese PoS corpus
         if 'macmorpho' in filepath and self.del_tag != '_':
@@ -94,21 +97,28 @@ class Corpus:
                             'but you passed `{}`'.format(self.del_tag))
 
         # load the file and fill words and tags examples
+        self.add_tagged_texts(self.iter_lines(filepath, byte_range))
+
+    def add_tagged_texts(self, lines):
+        """
+        Add a list of tagged texts to the corpus.
+        :param lines: an iterable of strings formatted as the lines of
+                      a corpus file (see `read`)
+        """
         words_for_example = []
         tags_for_example = []
-        with open(filepath, 'r', encoding='utf8') as f:
-            for line in f:
-                line = Cleaner.trim(line.strip())
-                words, tags = zip(
-                    *list(
-                        map(
-                            lambda x: x.rsplit(self.del_tag, 1),
-                            line.split(self.del_word)
-                        )
+        for line in lines:
+            line = Cleaner.trim(line.strip())
+            words, tags = zip(
+                *list(
+                    map(
+                        lambda x: x.rsplit(self.del_tag, 1),
+                        line.split(self.del_word)
                     )
                 )
-                words_for_example.append(self._normalize(' '.join(words)))
-                tags_for_example.append(' '.join(tags))
+            )
+            words_for_example.append(self._normalize(' '.join(words)))
+            tags_for_example.append(' '.join(tags))
         # add words and tags examples
         self.fields_examples[self.attr_index['words']] = words_for_example
         if 'tags' in self.attr_index:
@@ -119,6 +129,25 @@ class Corpus:
         assert min(nb_lines) == max(nb_lines)
         self.nb_examples = nb_lines[0]
 
+    @staticmethod
+    def iter_lines(filepath, byte_range=None):
+        """
+        Lazily read the lines of a file.
+        :param filepath: path to a file
+        :param byte_range: a tuple (start, end) to yield only the lines
+                           whose first byte is in the [start, end) interval.
+                           `start` should point to the beginning of a line.
+        """
+        start, end = (0, None) if byte_range is None else byte_range
+        with open(filepath, 'rb') as f:
+            f.seek(start)
+            position = start
+            for line in f:
+                if end is not None and position >= end:
+                    break
+                position += len(line)
+                yield line.decode('utf8')
+
     def __iter__(self):
         for j in range(self.nb_examples):
             fields_values_for_example = [self.fields_examples[i][j]
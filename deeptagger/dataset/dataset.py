@@ -3,25 +3,30 @@ from torchtext.data import Dataset
 from deeptagger.dataset.corpus import Corpus
 
 
-def build(path, fields_tuples, options):
+def build(path, fields_tuples, options, byte_range=None):
     def filter_len(x):
         return options.min_length <= len(x.words) <= options.max_length
     corpus = Corpus(fields_tuples, options.del_word, options.del_tag)
-    corpus.read(path)
-    feature_fields = list(filter(lambda x: x[0] not in ['words', 'tags'],
-                                 fields_tuples))
-    if feature_fields:
-        corpus.add_features(feature_fields,
-                            options.prefix_min_length,
-                            options.prefix_max_length,
-                            options.suffix_min_length,
-                            options.suffix_max_length)
+    corpus.read(path, byte_range=byte_range)
+    add_features(corpus, fields_tuples, options)
     return PoSDataset(corpus, filter_pred=filter_len)
 
 
+def build_tagged_texts(lines, fields_tuples, options):
+    corpus = Corpus(fields_tuples, options.del_word, options.del_tag)
+    corpus.add_tagged_texts(lines)
+    add_features(corpus, fields_tuples, options)
+    return PoSDataset(corpus)
+
+
 def build_texts(texts, fields_tuples, options):
     corpus = Corpus(fields_tuples)
     corpus.add_texts(texts)
+    add_features(corpus, fields_tuples, options)
+    return PoSDataset(corpus)
+
+
+def add_features(corpus, fields_tuples, options):
     feature_fields = list(filter(lambda x: x[0] not in ['words', 'tags'],
                                  fields_tuples))
     if feature_fields:
@@ -30,7 +35,6 @@ def build_texts(texts, fields_tuples, options):
                             options.prefix_max_length,
                             options.suffix_min_length,
                             options.suffix_max_length)
-    return PoSDataset(corpus)
 
 
 class PoSDataset(Dataset):
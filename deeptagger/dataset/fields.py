@@ -1,5 +1,5 @@
 import logging
-from collections import defaultdict
+from collections import Counter, defaultdict
 from pathlib import Path
 
 import torch
@@ -7,20 +7,16 @@ from torchtext.data import Field
 
 from deeptagger import constants
 from deeptagger.dataset.vocabulary import Vocabulary
-from deeptagger.dataset.vectors import (Polyglot,
-                                        Word2Vec,
-                                        FastText,
-                                        Glove,
-                                        Fonseca)
+from deeptagger.lazy import LazyDict
 
 
-available_embeddings = {
-    'polyglot': Polyglot,
-    'word2vec': Word2Vec,
-    'fasttext': FastText,
-    'glove': Glove,
-    'fonseca': Fonseca,
-}
+available_embeddings = LazyDict({
+    'polyglot': 'deeptagger.dataset.vectors.Polyglot',
+    'word2vec': 'deeptagger.dataset.vectors.Word2Vec',
+    'fasttext': 'deeptagger.dataset.vectors.FastText',
+    'glove': 'deeptagger.dataset.vectors.Glove',
+    'fonseca': 'deeptagger.dataset.vectors.Fonseca',
+})
 
 
 def load_vectors(options):
@@ -54,28 +50,60 @@ def build_vocabs(fields_tuples, train_dataset, all_datasets, options):
         dict_fields['suffixes'].build_vocab(train_dataset)
     if 'caps' in dict_fields:
         dict_fields['caps'].build_vocab(train_dataset)
-    constants.PAD_ID = dict_fields['words'].vocab.stoi[constants.PAD]
+    check_pad_ids(dict_fields)
+    if getattr(options, 'tag_dictionary', None) is not None:
+        tags_field.tag_dictionary = build_tag_dictionary(
+            words_field, tags_field, train_dataset, options.tag_dictionary)
+
+
+def build_tag_dictionary(words_field, tags_field, dataset, min_frequency):
+    """Find the tags each word was seen with in `dataset`.
+
+    Returns:
+        torch.BoolTensor: (nb_words, nb_tags) tags allowed for each word.
+            Words seen less than `min_frequency` times, unknown words and
+            special tokens allow all tags.
+    """
+    words_stoi = words_field.vocab.stoi
+    tags_stoi = tags_field.vocab.stoi
+    tag_dictionary = torch.zeros(len(words_field.vocab), len(tags_field.vocab),
+                                 dtype=torch.bool)
+    counts = Counter()
+    for example in dataset.examples:
+        word_ids = [words_stoi[word] for word in example.words]
+        tag_ids = [tags_stoi[tag] for tag in example.tags]
+        tag_dictionary[word_ids, tag_ids] = True
+        counts.update(word_ids)
+    frequent = torch.zeros(len(words_field.vocab), dtype=torch.bool)
+    for word_id, count in counts.items():
+        frequent[word_id] = count >= min_frequency
+    frequent[words_stoi[constants.UNK]] = False
+    tag_dictionary[~frequent] = True
+    logging.info('Tag dictionary: {} words with restricted tags'.format(
+        int(frequent.sum())))
+    return tag_dictionary
+
+
+def check_pad_ids(dict_fields):
+    # all inputs are expected to be padded with the same id
+    pad_id = dict_fields['words'].vocab.stoi[constants.PAD]
     for attr in ['words', 'prefixes', 'suffixes', 'caps']:
         if attr in dict_fields:
-            assert (constants.PAD_ID == dict_fields[attr].vocab.stoi[constants.PAD])  # NOQA
-    constants.TAGS_PAD_ID = dict_fields['tags'].vocab.stoi[constants.PAD]
-    constants.NB_LABELS = len(dict_fields['tags'].vocab)
+            assert pad_id == dict_fields[attr].vocab.stoi[constants.PAD]
 
 
 def load_vocabs(path, fields_tuples):
     vocab_path = Path(path, constants.VOCAB)
     vocabs = torch.load(str(vocab_path),
                         map_location=lambda storage, loc: storage)
-    vocabs = dict(vocabs)
+    set_vocabs(fields_tuples, dict(vocabs))
+
+
+def set_vocabs(fields_tuples, vocabs):
     for name, field in fields_tuples:
         field.vocab = vocabs[name]
     dict_fields = dict(fields_tuples)
-    constants.PAD_ID = dict_fields['words'].vocab.stoi[constants.PAD]
-    for attr in ['words', 'prefixes', 'suffixes', 'caps']:
-        if attr in dict_fields:
-            assert (constants.PAD_ID == dict_fields[attr].vocab.stoi[constants.PAD])  # NOQA
-    constants.TAGS_PAD_ID = dict_fields['tags'].vocab.stoi[constants.PAD]
-    constants.NB_LABELS = len(dict_fields['tags'].vocab)
+    check_pad_ids(dict_fields)
 
 
 def save_vocabs(path, fields_tuples):
@@ -0,0 +1,87 @@
+import re
+
+import numpy as np
+
+# Titles and abbreviations (in English and Portuguese) whose period doesn't
+# end a sentence. They are matched ignoring case, and kept with the period.
+# Abbreviations that are also common words (e.g. "art.", "fig.") are left out.
+ABBREVIATIONS = [
+    'mr', 'mrs', 'ms', 'dr', 'dra', 'drs', 'dras', 'prof', 'profa', 'profs',
+    'sr', 'sra', 'srs', 'sras', 'srta', 'jr', 'st', 'sto', 'sta', 'gen',
+    'gov', 'rev', 'capt', 'lt', 'sgt', 'exmo', 'exma', 'ilmo', 'ilma', 'av',
+    'vs', 'vol', 'pp', 'pág', 'págs',
+]
+
+# Tokens are matched in a single pass over the text. The alternatives are
+# tried in order, so urls, emails, abbreviations and numbers are kept as a
+# single token before falling back to words and single symbols.
+TOKEN_RE = re.compile(r"""
+    (?P<par>\n[ \t\r\f\v]*\n)                   # paragraph break
+  | (?P<end>\.\.\.|[.!?]+|…)                    # end of sentence
+  | (?P<close>["'”’»)\]}])                      # closing quotes and brackets
+  | (?P<word>
+        (?:https?://|www\.)[^\s]*[^\s.,;:!?"')\]]  # urls
+      | [\w.+-]+@\w+(?:\.\w+)+                  # emails
+      | (?i:%s)\.(?!\w)                         # abbreviations like Dr.
+      | (?:[^\W\d_]\.){2,}                      # abbreviations like U.S.
+      | \d+(?:[.,:/-]\d+)*                      # numbers, dates and hours
+      | \w+(?:[-'’]\w+)*                        # words
+      | \S                                      # any other symbol
+    )
+""" % '|'.join(sorted(ABBREVIATIONS, key=len, reverse=True)), re.VERBOSE)
+
+
+def tokenize_document(text, max_length=200):
+    """Split a raw text into sentences and tokens.
+
+    Sentences end at `.`, `!`, `?` or ellipsis (along with the closing
+    quotes and brackets glued to them) unless the next word is
+    lowercased or the period belongs to one of the `ABBREVIATIONS`, and at
+    paragraph breaks. Sentences longer than `max_length`
+    tokens are split.
+
+    Returns:
+        tokens (list of str): all tokens of the text
+        spans (np.ndarray): (nb_tokens, 2) start and end char offsets of
+            each token, so `text[start:end] == token`
+        offsets (np.ndarray): the tokens of the sentence i are
+            `tokens[offsets[i]:offsets[i+1]]`
+    """
+    tokens = []
+    starts = []
+    ends = []
+    offsets = [0]
+    after_end = False
+    for match in TOKEN_RE.finditer(text):
+        kind = match.lastgroup
+        if kind == 'par':
+            if len(tokens) > offsets[-1]:
+                offsets.append(len(tokens))
+            after_end = False
+            continue
+        token = match.group()
+        # quotes are ambiguous, they only close a sentence when they are
+        # right after it
+        closes = (after_end and kind == 'close'
+                  and match.start() == ends[-1])
+        if after_end and not closes:
+            if not token[0].islower():
+                offsets.append(len(tokens))
+            after_end = False
+        elif len(tokens) - offsets[-1] >= max_length:
+            offsets.append(len(tokens))
+        tokens.append(token)
+        starts.append(match.start())
+        ends.append(match.end())
+        after_end = after_end or kind == 'end'
+    if len(tokens) > offsets[-1]:
+        offsets.append(len(tokens))
+    spans = np.array([starts, ends], dtype=np.int64).T.reshape(-1, 2)
+    return tokens, spans, np.array(offsets, dtype=np.int64)
+
+
+def join_sentences(tokens, offsets):
+    """Return the sentences as strings of tokens separated by spaces, which
+    is the format expected by `Tagger.predict`."""
+    return [' '.join(tokens[start:end])
+            for start, end in zip(offsets[:-1], offsets[1:])]
@@ -1,4 +1,7 @@
-from torchtext.data import BucketIterator
+import math
+
+import numpy as np
+from torchtext.data import Batch, BucketIterator
 import torch
 
 
@@ -19,3 +22,78 @@ def build(dataset, device, batch_size, is_train):
         train=is_train
     )
     return iterator
+
+
+def build_sorted(dataset, device, batch_size):
+    device = None if device is None else torch.device(device)
+    return SortedIterator(dataset, batch_size, device=device)
+
+
+class SortedIterator:
+    """Iterate over batches of examples sorted in decreasing order of length,
+    so that batches have few pad tokens and can be packed right away.
+
+    Unlike BucketIterator, it keeps track of the original position of each
+    example, so predictions can be put back in the input order with
+    `restore_order`. Meant to be used only for inference.
+    """
+
+    def __init__(self, dataset, batch_size, device=None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.device = device
+        lengths = [dataset.sort_key(ex) for ex in dataset.examples]
+        self.order = sorted(range(len(lengths)),
+                            key=lengths.__getitem__,
+                            reverse=True)
+        self._batches = None
+
+    def __len__(self):
+        return math.ceil(len(self.order) / self.batch_size)
+
+    def __iter__(self):
+        if self._batches is not None:
+            yield from self._batches
+            return
+        for i in range(0, len(self.order), self.batch_size):
+            indexes = self.order[i:i + self.batch_size]
+            examples = [self.dataset.examples[j] for j in indexes]
+            yield Batch(examples, self.dataset, self.device)
+
+    def prefetch(self):
+        """Numericalize and pad all batches beforehand, so that iterating
+        over them later is almost free."""
+        self._batches = list(self)
+
+    def restore_order(self, predictions):
+        """Map a list of predictions made in the iteration order back to
+        the order of the examples in the dataset."""
+        restored = [None] * len(predictions)
+        for i, j in enumerate(self.order):
+            restored[j] = predictions[i]
+        return restored
+
+    def restore_flat_order(self, flat, lengths):
+        """Same as `restore_order`, but for the predictions of all sentences
+        concatenated in a single array.
+
+        Args:
+            flat (np.ndarray): predictions with shape (nb_tokens, ...)
+            lengths (np.ndarray): length of each sentence in iteration order
+
+        Returns:
+            np.ndarray: predictions with shape (nb_tokens, ...) following
+                the dataset order
+            np.ndarray: offsets with shape (nb_sentences + 1,) where the
+                predictions of sentence i are flat[offsets[i]:offsets[i+1]]
+        """
+        starts = np.cumsum(lengths) - lengths
+        # iteration position of each sentence of the dataset
+        positions = np.argsort(self.order)
+        lengths = lengths[positions]
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # shift each token from its new start back to the old one
+        shifts = np.repeat(starts[positions] - offsets[:-1], lengths)
+        indexes = np.arange(offsets[-1]) + shifts
+        return flat[indexes], offsets
@@ -0,0 +1,33 @@
+import importlib
+from collections.abc import Mapping
+
+
+def import_object(path):
+    """Import an object from its full dotted path, e.g. `torch.optim.Adam`.
+    """
+    module_name, _, name = path.rpartition('.')
+    return getattr(importlib.import_module(module_name), name)
+
+
+class LazyDict(Mapping):
+    """Read-only dict whose values are given as dotted import paths and are
+    only imported when accessed. Keys can be listed without importing
+    anything, so registries can be used for argparse choices for free."""
+
+    def __init__(self, paths):
+        self._paths = dict(paths)
+        self._objects = {}
+
+    def __getitem__(self, key):
+        if key not in self._objects:
+            self._objects[key] = import_object(self._paths[key])
+        return self._objects[key]
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self._paths)
@@ -3,18 +3,23 @@ from pathlib import Path
 
 from deeptagger import constants
 from deeptagger import opts
-from .cnn import CNN
-from .rnn import RNN
-from .rcnn import RCNN
-from .simple_lstm import SimpleLSTM
+from deeptagger.lazy import LazyDict
 
 
-available_models = {
-    'simple_lstm': SimpleLSTM,
-    'rcnn': RCNN,
-    'cnn': CNN,
-    'rnn': RNN,
-}
+# model classes are imported only when they are used
+available_models = LazyDict({
+    'simple_lstm': 'deeptagger.models.simple_lstm.SimpleLSTM',
+    'rcnn': 'deeptagger.models.rcnn.RCNN',
+    'cnn': 'deeptagger.models.cnn.CNN',
+    'rnn': 'deeptagger.models.rnn.RNN',
+})
+
+# layers replaced by their int8 counterparts in `quantize()`
+quantizable_modules = LazyDict({
+    'linear': 'torch.nn.Linear',
+    'lstm': 'torch.nn.LSTM',
+    'gru': 'torch.nn.GRU',
+})
 
 
 def build(options, fields_tuples):
@@ -28,19 +33,68 @@ def build(options, fields_tuples):
                         suffixes_field=dict_fields['suffixes'],
                         caps_field=dict_fields['caps'])
     model.build(options)
+    if getattr(options, 'tag_dictionary', None) is not None:
+        # filled by `fields.build_vocabs` when training, or by the saved
+        # weights when loading
+        tag_dictionary = getattr(dict_fields['tags'], 'tag_dictionary', None)
+        model.set_tag_dictionary(tag_dictionary)
     if options.gpu_id is not None:
         model = model.cuda(options.gpu_id)
     return model
 
 
+def quantize(model):
+    """Apply dynamic int8 quantization to the recurrent and linear layers.
+    Weights are stored as int8 and activations are quantized on the fly, so
+    the resulting model should be used only for inference on CPU."""
+    import torch
+    if not hasattr(torch, 'quantization'):
+        raise Exception('Dynamic quantization requires torch >= 1.3.')
+    model.eval()
+    modules = set(quantizable_modules.values())
+    return torch.quantization.quantize_dynamic(model,
+                                               modules,
+                                               dtype=torch.qint8,
+                                               inplace=True)
+
+
+def state_tensors(model):
+    """Yield the name and the tensor of each weight and buffer of `model`,
+    including the tensors inside the packed weights of quantized layers."""
+    import torch
+
+    def unpack(name, value):
+        if isinstance(value, torch.Tensor):
+            yield name, value
+        elif isinstance(value, (tuple, list)):
+            for i, v in enumerate(value):
+                yield from unpack('{}.{}'.format(name, i), v)
+        elif hasattr(value, '__getstate__') and not isinstance(value, type):
+            state = value.__getstate__()
+            if isinstance(state, (tuple, list)):
+                yield from unpack(name, state)
+
+    for name, value in model.state_dict().items():
+        yield from unpack(name, value)
+
+
+def memory_size(model):
+    """Number of bytes taken by the weights and buffers of `model`."""
+    return sum(tensor.numel() * tensor.element_size()
+               for _, tensor in state_tensors(model))
+
+
 def load_state(path, model):
     model_path = Path(path, constants.MODEL)
     model.load(str(model_path))
 
 
-def load(path, fields_tuples):
-    options = opts.load(path)
+def load(path, fields_tuples, options=None):
+    if options is None:
+        options = opts.load(path)
     model = build(options, fields_tuples)
+    if getattr(options, 'quantized', False):
+        model = quantize(model)
     load_state(path, model)
     return model
 
@@ -2,7 +2,6 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from deeptagger import constants
 from deeptagger.models.model import Model
 
 
@@ -35,7 +34,7 @@ class CNN(Model):
         self.word_emb = nn.Embedding(
             num_embeddings=len(self.words_field.vocab),
             embedding_dim=options.word_embeddings_size,
-            padding_idx=constants.PAD_ID,
+            padding_idx=self.pad_id,
             _weight=word_embeddings,
         )
         self.dropout_emb = nn.Dropout(options.emb_dropout)
@@ -62,7 +61,7 @@ class CNN(Model):
 
         self.init_weights()
         self._loss = nn.NLLLoss(weight=loss_weights,
-                                ignore_index=constants.TAGS_PAD_ID)
+                                ignore_index=self.tags_pad_id)
         self.is_built = True
 
     def init_weights(self):
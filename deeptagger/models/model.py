@@ -3,6 +3,7 @@ from abc import ABCMeta, abstractmethod
 
 import torch
 
+from deeptagger import constants
 from deeptagger.modules.handcrafted import HandCrafted
 
 
@@ -30,11 +31,22 @@ class Model(torch.nn.Module):
         self.is_built = False
         # Loss function has to be defined in build()
         self._loss = None
+        # (nb_words, nb_classes) tags allowed for each word, see
+        # `set_tag_dictionary`
+        self.register_buffer('tag_dictionary', None)
 
     @property
     def nb_classes(self):
         return len(self.tags_field.vocab.stoi)
 
+    @property
+    def pad_id(self):
+        return self.words_field.vocab.stoi[constants.PAD]
+
+    @property
+    def tags_pad_id(self):
+        return self.tags_field.vocab.stoi[constants.PAD]
+
     def loss(self, pred, gold):
         # (bs*ts, nb_classes)
         predicted = pred.reshape(-1, self.nb_classes)
@@ -57,9 +69,26 @@ class Model(torch.nn.Module):
         return torch.exp(pred)  # assume log softmax in the output
 
     def predict_classes(self, batch):
-        _, classes = torch.max(self.predict_proba(batch), -1)
+        probas = self.predict_proba(batch)
+        if self.tag_dictionary is not None:
+            # (bs, ts-2, nb_classes) tags allowed for each word, ignoring the
+            # <bos> and <eos> tokens like the predictions
+            allowed = self.tag_dictionary[batch.words[:, 1:-1]]
+            probas = probas.masked_fill(~allowed, -1)
+        _, classes = torch.max(probas, -1)
         return classes
 
+    def set_tag_dictionary(self, tag_dictionary=None):
+        """Restrict the classes predicted for each word to the ones allowed
+        by `tag_dictionary`, a (nb_words, nb_classes) boolean tensor (see
+        `fields.build_tag_dictionary`). It is saved with the weights of the
+        model. If None, all classes are allowed until the weights are
+        loaded."""
+        if tag_dictionary is None:
+            tag_dictionary = torch.ones(len(self.words_field.vocab),
+                                        self.nb_classes, dtype=torch.bool)
+        self.register_buffer('tag_dictionary', tag_dictionary)
+
     def load(self, path):
         logging.debug("Loading model weights from {}".format(path))
         self.load_state_dict(
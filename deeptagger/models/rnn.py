@@ -4,7 +4,6 @@ import torch.nn.functional as F
 from torch.nn.utils.rnn import pack_padded_sequence as pack
 from torch.nn.utils.rnn import pad_packed_sequence as unpack
 
-from deeptagger import constants
 from deeptagger.models.model import Model
 
 
@@ -21,7 +20,6 @@ class RNN(Model):
         self.rnn_layers = 1
         self.rnn_type = 'rnn'
         self.rnn = None
-        self.hidden = None
         self.dropout_rnn = None
         self.linear_out = None
         self.selu = None
@@ -44,7 +42,7 @@ class RNN(Model):
         self.word_emb = nn.Embedding(
             num_embeddings=len(self.words_field.vocab),
             embedding_dim=options.word_embeddings_size,
-            padding_idx=constants.PAD_ID,
+            padding_idx=self.pad_id,
             _weight=word_embeddings
         )
 
@@ -84,21 +82,22 @@ class RNN(Model):
 
         # Loss
         self._loss = nn.NLLLoss(weight=loss_weights,
-                                ignore_index=constants.TAGS_PAD_ID)
+                                ignore_index=self.tags_pad_id)
 
         self.is_built = True
 
     def init_weights(self):
         pass
 
-    def init_hidden(self, batch_size, hidden_size):
+    def init_hidden(self, batch_size, hidden_size, device=None):
         # The axes semantics are (num_layers, minibatch_size, hidden_dim)
         num_layers = 2 if self.is_bidir else 1
+        shape = (num_layers, batch_size, hidden_size)
         if self.rnn_type == 'lstm':
-            return (torch.zeros(num_layers, batch_size, hidden_size),
-                    torch.zeros(num_layers, batch_size, hidden_size))
+            return (torch.zeros(shape, device=device),
+                    torch.zeros(shape, device=device))
         else:
-            return torch.zeros(num_layers, batch_size, hidden_size)
+            return torch.zeros(shape, device=device)
 
     def forward(self, batch):
         assert self.is_built
@@ -106,12 +105,13 @@ class RNN(Model):
         # (ts, bs) -> (bs, ts)
         bs, ts = batch.words.shape
         h = batch.words
-        mask = h != constants.PAD_ID
+        mask = h != self.pad_id
         lengths = mask.int().sum(dim=-1)
 
         # initialize GRU hidden state
-        self.hidden = self.init_hidden(batch.words.shape[0],
-                                       self.rnn.hidden_size)
+        hidden = self.init_hidden(batch.words.shape[0],
+                                  self.rnn.hidden_size,
+                                  device=h.device)
 
         # (bs, ts) -> (bs, ts, emb_dim)
         h = self.word_emb(h)
@@ -126,7 +126,7 @@ class RNN(Model):
 
         # (bs, ts, pool_size) -> (bs, ts, hidden_size)
         h = pack(h, lengths, batch_first=True)
-        h, self.hidden = self.rnn(h, self.hidden)
+        h, _ = self.rnn(h, hidden)
         h, _ = unpack(h, batch_first=True)
 
         # if you'd like to sum instead of concatenate:
@@ -4,7 +4,6 @@ import torch.nn.functional as F
 from torch.nn.utils.rnn import pack_padded_sequence as pack
 from torch.nn.utils.rnn import pad_packed_sequence as unpack
 
-from deeptagger import constants
 from deeptagger.models.model import Model
 
 
@@ -19,7 +18,6 @@ class SimpleLSTM(Model):
         self.is_bidir = None
         self.sum_bidir = None
         self.gru = None
-        self.hidden = None
         self.dropout_gru = None
         self.linear_out = None
         self.relu = None
@@ -42,7 +40,7 @@ class SimpleLSTM(Model):
         self.word_emb = nn.Embedding(
             num_embeddings=len(self.words_field.vocab),
             embedding_dim=options.word_embeddings_size,
-            padding_idx=constants.PAD_ID,
+            padding_idx=self.pad_id,
             _weight=word_embeddings
         )
 
@@ -61,7 +59,6 @@ class SimpleLSTM(Model):
                            hidden_size,
                            bidirectional=options.bidirectional,
                            batch_first=True)
-        self.hidden = None
 
         n = 2 if self.is_bidir else 1
         n = 1 if self.sum_bidir else n
@@ -76,18 +73,19 @@ class SimpleLSTM(Model):
 
         # Loss
         self._loss = nn.NLLLoss(weight=loss_weights,
-                                ignore_index=constants.TAGS_PAD_ID)
+                                ignore_index=self.tags_pad_id)
 
         self.is_built = True
 
     def init_weights(self):
         pass
 
-    def init_hidden(self, batch_size, hidden_size):
+    def init_hidden(self, batch_size, hidden_size, device=None):
         # The axes semantics are (num_layers, minibatch_size, hidden_dim)
         num_layers = 2 if self.is_bidir else 1
-        return (torch.zeros(num_layers, batch_size, hidden_size),
-                torch.zeros(num_layers, batch_size, hidden_size))
+        shape = (num_layers, batch_size, hidden_size)
+        return (torch.zeros(shape, device=device),
+                torch.zeros(shape, device=device))
 
     def forward(self, batch):
         assert self.is_built
@@ -95,12 +93,13 @@ class SimpleLSTM(Model):
         # (ts, bs) -> (bs, ts)
         bs, ts = batch.words.shape
         h = batch.words
-        mask = h != constants.PAD_ID
+        mask = h != self.pad_id
         lengths = mask.int().sum(dim=-1)
 
         # initialize GRU hidden state
-        self.hidden = self.init_hidden(batch.words.shape[0],
-                                       self.gru.hidden_size)
+        hidden = self.init_hidden(batch.words.shape[0],
+                                  self.gru.hidden_size,
+                                  device=h.device)
 
         # (bs, ts) -> (bs, ts, emb_dim)
         h = self.word_emb(h)
@@ -115,7 +114,7 @@ class SimpleLSTM(Model):
 
         # (bs, ts, pool_size) -> (bs, ts, hidden_size)
         h = pack(h, lengths, batch_first=True)
-        h, self.hidden = self.gru(h, self.hidden)
+        h, _ = self.gru(h, hidden)
         h, _ = unpack(h, batch_first=True)
 
         # if you'd like to sum instead of concatenate:
@@ -1,6 +1,8 @@
 # flake8: noqa: E501
 """ Code from: https://github.com/mtreviso/linear-chain-crf """
 
+from collections import deque
+
 import torch
 from torch import nn
 
@@ -18,6 +20,16 @@ class CRF(nn.Module):
             If None, the model will treat the PAD as a normal tag. Otherwise, the model
             will apply constraints for PAD transitions.
         batch_first (bool): Whether the first dimension represents the batch dimension.
+        memory_efficient (bool): Whether to compute the gradients of the partition
+            function with an explicit forward-backward pass (see `LogPartition`),
+            keeping only O(seq_len * batch_size * nb_labels) values for backward
+            instead of every (batch_size, nb_labels, nb_labels) step.
+        parallel_scan_length (int, optional): Sequences of at least this length
+            compute the partition function and the Viterbi decoding with a
+            parallel scan (see `semiring_scan`), in O(log seq_len) sequential
+            steps instead of seq_len. The total work grows to
+            O(seq_len * nb_labels^3), so it only pays off for long sequences,
+            small batches and small tagsets. If None, it is never used.
     """
 
     def __init__(
@@ -26,7 +38,9 @@ class CRF(nn.Module):
         bos_tag_id, 
         eos_tag_id, 
         pad_tag_id=None, 
-        batch_first=True
+        batch_first=True,
+        memory_efficient=False,
+        parallel_scan_length=None
     ):
         super().__init__()
 
@@ -35,6 +49,8 @@ class CRF(nn.Module):
         self.EOS_TAG_ID = eos_tag_id
         self.PAD_TAG_ID = pad_tag_id
         self.batch_first = batch_first
+        self.memory_efficient = memory_efficient
+        self.parallel_scan_length = parallel_scan_length
 
         self.transitions = nn.Parameter(torch.empty(self.nb_labels, self.nb_labels))
         self.init_weights()
@@ -99,7 +115,7 @@ class CRF(nn.Module):
         partition = self._compute_log_partition(emissions, mask=mask)
         return torch.mean(scores - partition)  # changed from sum to mean
 
-    def decode(self, emissions, mask=None):
+    def decode(self, emissions, mask=None, allowed_tags=None):
         """Find the most probable sequence of labels given the emissions using
         the Viterbi algorithm.
 
@@ -111,17 +127,102 @@ class CRF(nn.Module):
                 If None, all positions are considered valid.
                 Shape (batch_size, seq_len) if batch_first is True,
                 (seq_len, batch_size) otherwise.
+            allowed_tags (torch.BoolTensor, optional): Tags allowed at each position,
+                e.g. from a tag dictionary. If None, all tags are allowed.
+                Shape (batch_size, seq_len, nb_labels).
 
         Returns:
             torch.Tensor: the viterbi score for the for each batch.
                 Shape of (batch_size,)
-            list of lists: the best viterbi sequence of labels for each batch.
+            torch.LongTensor: the best viterbi sequence of labels for each batch,
+                padded with PAD_TAG_ID (or 0 if it is None) after the end of each
+                sequence. Shape of (batch_size, seq_len)
+            torch.LongTensor: the length of each sequence. Shape of (batch_size,)
+        """
+        if mask is None:
+            mask = torch.ones(emissions.shape[:2], dtype=torch.float)
+
+        if allowed_tags is not None:
+            emissions = self._constrain(emissions, allowed_tags)
+
+        scores, sequences, lengths = self._viterbi_decode(emissions, mask)
+        return scores, sequences, lengths
+
+    def decode_kbest(self, emissions, k, mask=None, allowed_tags=None):
+        """Find the k most probable sequences of labels given the emissions using
+        a k-best Viterbi algorithm, in a single pass whose cost grows linearly
+        with k.
+
+        Args:
+            emissions (torch.Tensor): Sequence of emissions for each label.
+                Shape (batch_size, seq_len, nb_labels) if batch_first is True,
+                (seq_len, batch_size, nb_labels) otherwise.
+            k (int): number of sequences to return for each batch.
+            mask (torch.FloatTensor, optional): Tensor representing valid positions.
+                If None, all positions are considered valid.
+                Shape (batch_size, seq_len) if batch_first is True,
+                (seq_len, batch_size) otherwise.
+            allowed_tags (torch.BoolTensor, optional): Tags allowed at each position.
+                See `decode`.
+
+        Returns:
+            torch.Tensor: the scores of the k best sequences for each batch, in
+                decreasing order. Shape of (batch_size, k)
+            torch.LongTensor: the k best sequences of labels for each batch, padded
+                like in `decode`. Shape of (batch_size, k, seq_len)
+            torch.LongTensor: the length of each sequence. Shape of (batch_size,)
         """
         if mask is None:
             mask = torch.ones(emissions.shape[:2], dtype=torch.float)
 
-        scores, sequences = self._viterbi_decode(emissions, mask)
-        return scores, sequences
+        if allowed_tags is not None:
+            emissions = self._constrain(emissions, allowed_tags)
+
+        scores, sequences, lengths = self._kbest_viterbi_decode(emissions, mask, k)
+        return scores, sequences, lengths
+
+    def stream_decoder(self, lag):
+        """Return a `FixedLagDecoder` for decoding unbounded streams of emissions
+        with this CRF, committing each tag once `lag` newer emissions are seen."""
+        return FixedLagDecoder(self, lag)
+
+    def marginals(self, emissions, mask=None):
+        """Compute the probability of each label at each position given the
+        emissions (the posterior marginals) using the forward-backward algorithm.
+
+        Args:
+            emissions (torch.Tensor): Sequence of emissions for each label.
+                Shape (batch_size, seq_len, nb_labels) if batch_first is True,
+                (seq_len, batch_size, nb_labels) otherwise.
+            mask (torch.FloatTensor, optional): Tensor representing valid positions.
+                If None, all positions are considered valid.
+                Shape (batch_size, seq_len) if batch_first is True,
+                (seq_len, batch_size) otherwise.
+
+        Returns:
+            torch.Tensor: the marginal probabilities, which sum to 1 over the labels
+                of valid positions and are 0 for padded positions.
+                Shape (batch_size, seq_len, nb_labels) if batch_first is True,
+                (seq_len, batch_size, nb_labels) otherwise.
+        """
+        if not self.batch_first:
+            emissions = emissions.transpose(0, 1)
+            if mask is not None:
+                mask = mask.transpose(0, 1)
+
+        if mask is None:
+            mask = torch.ones(emissions.shape[:2], dtype=torch.float)
+
+        marginals = self._compute_marginals(emissions, mask)
+
+        if not self.batch_first:
+            marginals = marginals.transpose(0, 1)
+        return marginals
+
+    @staticmethod
+    def _constrain(emissions, allowed_tags):
+        # forbidden tags get the same big negative score as forbidden transitions
+        return emissions.masked_fill(~allowed_tags, -10000.0)
 
     def _compute_scores(self, emissions, tags, mask):
         """Compute the scores for a given batch of emissions with their tags.
@@ -135,49 +236,29 @@ class CRF(nn.Module):
             torch.Tensor: Scores for each batch.
                 Shape of (batch_size,)
         """
-        batch_size, seq_length = tags.shape
-        scores = torch.zeros(batch_size)
-
         # save first and last tags to be used later
         first_tags = tags[:, 0]
-        last_valid_idx = mask.int().sum(1) - 1
-        last_tags = tags.gather(1, last_valid_idx.unsqueeze(1)).squeeze()
+        last_valid_idx = mask.long().sum(1) - 1
+        last_tags = tags.gather(1, last_valid_idx.unsqueeze(1)).squeeze(1)
 
         # add the transition from BOS to the first tags for each batch
-        t_scores = self.transitions[self.BOS_TAG_ID, first_tags]
+        # and the transition from the last tags to EOS
+        scores = self.transitions[self.BOS_TAG_ID, first_tags]
+        scores = scores + self.transitions[last_tags, self.EOS_TAG_ID]
 
-        # add the [unary] emission scores for the first tags for each batch
-        # for all batches, the first word, see the correspondent emissions
-        # for the first tags (which is a list of ids):
-        # emissions[:, 0, [tag_1, tag_2, ..., tag_nblabels]]
-        e_scores = emissions[:, 0].gather(1, first_tags.unsqueeze(1)).squeeze()
+        # gold-path scores need no recurrence, so all timesteps are scored at
+        # once and the padded positions are zeroed out with the mask
 
-        # the scores for a word is just the sum of both scores
-        scores += e_scores + t_scores
+        # the [unary] emission scores of the gold tags: (bs, seq_len)
+        e_scores = emissions.gather(2, tags.unsqueeze(2)).squeeze(2)
 
-        # now lets do this for each remaining word
-        for i in range(1, seq_length):
-
-            # we could: iterate over batches, check if we reached a mask symbol
-            # and stop the iteration, but vecotrizing is faster due to gpu,
-            # so instead we perform an element-wise multiplication
-            is_valid = mask[:, i]
-
-            previous_tags = tags[:, i - 1]
-            current_tags = tags[:, i]
-
-            # calculate emission and transition scores as we did before
-            e_scores = emissions[:, i].gather(1, current_tags.unsqueeze(1)).squeeze()
-            t_scores = self.transitions[previous_tags, current_tags]
-
-            # apply the mask
-            e_scores = e_scores * is_valid
-            t_scores = t_scores * is_valid
+        # the transition scores between consecutive gold tags: (bs, seq_len - 1)
+        t_scores = self.transitions[tags[:, :-1], tags[:, 1:]]
 
-            scores += e_scores + t_scores
-
-        # add the transition from the end tag to the EOS tag for each batch
-        scores += self.transitions[last_tags, self.EOS_TAG_ID]
+        # the first emission is always valid
+        e_mask = torch.cat([torch.ones_like(mask[:, :1]), mask[:, 1:]], dim=1)
+        scores = scores + (e_scores * e_mask).sum(1)
+        scores = scores + (t_scores * mask[:, 1:]).sum(1)
 
         return scores
 
@@ -192,6 +273,13 @@ class CRF(nn.Module):
             torch.Tensor: the partition scores for each batch.
                 Shape of (batch_size,)
         """
+        if self.memory_efficient:
+            return LogPartition.apply(emissions, self.transitions, mask,
+                                      self.BOS_TAG_ID, self.EOS_TAG_ID)
+
+        if self._use_parallel_scan(emissions):
+            return self._scan_log_partition(emissions, mask)
+
         batch_size, seq_length, nb_labels = emissions.shape
 
         # in the first iteration, BOS will have all the scores
@@ -221,6 +309,29 @@ class CRF(nn.Module):
         # return a *log* of sums of exps
         return torch.logsumexp(end_scores, dim=1)
 
+    def _compute_marginals(self, emissions, mask):
+        """Compute the posterior marginals with the forward-backward algorithm.
+
+        Args:
+            emissions (torch.Tensor): (batch_size, seq_len, nb_labels)
+            mask (Torch.FloatTensor): (batch_size, seq_len)
+
+        Returns:
+            torch.Tensor: (batch_size, seq_len, nb_labels)
+        """
+        mask = mask.to(emissions.dtype)
+
+        # (seq_len, bs, nb_labels) scores of all prefixes and of all suffixes
+        alphas = forward_alphas(emissions, self.transitions, mask, self.BOS_TAG_ID)
+        betas = backward_betas(emissions, self.transitions, mask, self.EOS_TAG_ID)
+
+        end_scores = alphas[-1] + self.transitions[:, self.EOS_TAG_ID].unsqueeze(0)
+        log_partition = torch.logsumexp(end_scores, dim=1)
+
+        # the score of all paths going through each label, normalized
+        marginals = torch.exp(alphas + betas - log_partition.view(1, -1, 1))
+        return marginals.transpose(0, 1) * mask.unsqueeze(-1)
+
     def _viterbi_decode(self, emissions, mask):
         """Compute the viterbi algorithm to find the most probable sequence of labels
         given a sequence of emissions.
@@ -232,8 +343,13 @@ class CRF(nn.Module):
         Returns:
             torch.Tensor: the viterbi score for the for each batch.
                 Shape of (batch_size,)
-            list of lists of ints: the best viterbi sequence of labels for each batch
+            torch.LongTensor: the best viterbi sequence of labels for each batch.
+                Shape of (batch_size, seq_len)
+            torch.LongTensor: the length of each sequence. Shape of (batch_size,)
         """
+        if self._use_parallel_scan(emissions):
+            return self._scan_viterbi_decode(emissions, mask)
+
         batch_size, seq_length, nb_labels = emissions.shape
 
         # in the first iteration, BOS will have all the scores and then, the max
@@ -241,6 +357,10 @@ class CRF(nn.Module):
 
         backpointers = []
 
+        # padded positions point to the same tag, so the backtrace of shorter
+        # sequences carries their last tag until their real end
+        identity = torch.arange(nb_labels, device=emissions.device).unsqueeze(0)
+
         for i in range(1, seq_length):
             # (bs, nb_labels) -> (bs, 1, nb_labels)
             e_scores = emissions[:, i].unsqueeze(1)
@@ -264,9 +384,9 @@ class CRF(nn.Module):
             alphas = is_valid * max_scores + (1 - is_valid) * alphas
 
             # add the max_score_tags for our list of backpointers
-            # max_scores has shape (batch_size, nb_labels) so we transpose it to
-            # be compatible with our previous loopy version of viterbi
-            backpointers.append(max_score_tags.t())
+            # (bs, nb_labels) holding the best previous tag for each current tag
+            max_score_tags = torch.where(is_valid.bool(), max_score_tags, identity)
+            backpointers.append(max_score_tags)
 
         # add the scores for the final transition
         last_transition = self.transitions[:, self.EOS_TAG_ID]
@@ -275,53 +395,483 @@ class CRF(nn.Module):
         # get the final most probable score and the final most probable tag
         max_final_scores, max_final_tags = torch.max(end_scores, dim=1)
 
-        # find the best sequence of labels for each sample in the batch
-        best_sequences = []
-        emission_lengths = mask.int().sum(dim=1)
-        for i in range(batch_size):
+        # follow the backpointers of the whole batch at once, from the last
+        # timestep to the first one
+        best_tags = max_final_tags.unsqueeze(1)
+        best_sequences = [best_tags]
+        for backpointers_t in reversed(backpointers):
+            best_tags = backpointers_t.gather(1, best_tags)
+            best_sequences.append(best_tags)
+        best_sequences.reverse()
+        best_sequences = torch.cat(best_sequences, dim=1)
 
-            # recover the original sentence length for the i-th sample in the batch
-            sample_length = emission_lengths[i].item()
+        # pad the positions after the end of each sequence
+        pad_id = self.PAD_TAG_ID if self.PAD_TAG_ID is not None else 0
+        best_sequences = best_sequences.masked_fill(mask == 0, pad_id)
+        emission_lengths = mask.long().sum(dim=1)
 
-            # recover the max tag for the last timestep
-            sample_final_tag = max_final_tags[i].item()
+        return max_final_scores, best_sequences, emission_lengths
 
-            # limit the backpointers until the last but one
-            # since the last corresponds to the sample_final_tag
-            sample_backpointers = backpointers[: sample_length - 1]
+    def _kbest_viterbi_decode(self, emissions, mask, k):
+        """Compute the k-best viterbi algorithm. Instead of the best score for
+        each label, it keeps the k best scores of paths ending at each label, and
+        the backpointers point to a (previous label, rank) pair.
 
-            # follow the backpointers to build the sequence of labels
-            sample_path = self._find_best_path(i, sample_final_tag, sample_backpointers)
+        Args:
+            emissions (torch.Tensor): (batch_size, seq_len, nb_labels)
+            mask (Torch.FloatTensor): (batch_size, seq_len)
+            k (int): number of best sequences
 
-            # add this path to the list of best sequences
-            best_sequences.append(sample_path)
+        Returns:
+            torch.Tensor: (batch_size, k) the scores of the k best sequences.
+                If there are less than k possible sequences, the missing ones
+                have a score of -inf.
+            torch.LongTensor: (batch_size, k, seq_len) the k best sequences.
+            torch.LongTensor: (batch_size,) the length of each sequence.
+        """
+        batch_size, seq_length, nb_labels = emissions.shape
+
+        # (bs, nb_labels, k): only the first rank holds a path at the beginning
+        alphas = emissions.new_full((batch_size, nb_labels, k), float('-inf'))
+        alphas[:, :, 0] = self.transitions[self.BOS_TAG_ID, :].unsqueeze(0) + emissions[:, 0]
+
+        # the states of a timestep are flattened (label, rank) pairs, and the
+        # backpointers of padded positions point to the same state
+        identity = torch.arange(nb_labels * k, device=emissions.device).unsqueeze(0)
+
+        backpointers = []
+        for i in range(1, seq_length):
+            # (bs, nb_labels * k, nb_labels): from each previous state to each label
+            scores = (alphas.reshape(batch_size, nb_labels, k, 1)
+                      + self.transitions.view(1, nb_labels, 1, nb_labels)
+                      + emissions[:, i].view(batch_size, 1, 1, nb_labels))
+            scores = scores.reshape(batch_size, nb_labels * k, nb_labels)
+
+            # the k best previous states for each label: (bs, k, nb_labels)
+            max_scores, max_states = torch.topk(scores, k, dim=1)
+            max_scores = max_scores.transpose(1, 2)
+            max_states = max_states.transpose(1, 2).reshape(batch_size, nb_labels * k)
+
+            # -inf scores can't be blended with the mask, so use where instead
+            is_valid = mask[:, i].bool().unsqueeze(-1)
+            alphas = torch.where(is_valid.unsqueeze(-1), max_scores, alphas)
+            backpointers.append(torch.where(is_valid, max_states, identity))
+
+        # add the scores for the final transition
+        last_transition = self.transitions[:, self.EOS_TAG_ID].view(1, nb_labels, 1)
+        end_scores = (alphas + last_transition).reshape(batch_size, nb_labels * k)
+        max_final_scores, max_final_states = torch.topk(end_scores, k, dim=1)
 
-        return max_final_scores, best_sequences
+        # follow the backpointers of all k paths of the whole batch at once
+        states = max_final_states
+        best_states = [states]
+        for backpointers_t in reversed(backpointers):
+            states = backpointers_t.gather(1, states)
+            best_states.append(states)
+        best_states.reverse()
+        best_sequences = torch.stack(best_states, dim=2) // k
+
+        pad_id = self.PAD_TAG_ID if self.PAD_TAG_ID is not None else 0
+        best_sequences = best_sequences.masked_fill(mask.unsqueeze(1) == 0, pad_id)
+        emission_lengths = mask.long().sum(dim=1)
+
+        return max_final_scores, best_sequences, emission_lengths
 
-    def _find_best_path(self, sample_id, best_tag, backpointers):
-        """Auxiliary function to find the best path sequence for a specific sample.
+    def _use_parallel_scan(self, emissions):
+        return (self.parallel_scan_length is not None
+                and emissions.shape[1] >= self.parallel_scan_length)
 
-            Args:
-                sample_id (int): sample index in the range [0, batch_size)
-                best_tag (int): tag which maximizes the final score
-                backpointers (list of lists of tensors): list of pointers with
-                shape (seq_len_i-1, nb_labels, batch_size) where seq_len_i
-                represents the length of the ith sample in the batch
+    def _step_matrices(self, emissions, mask):
+        """Write the recurrence of the forward algorithm as a product of
+        matrices in a semiring: the alphas at timestep i are the initial alphas
+        times the matrices from 1 to i.
 
-            Returns:
-                list of ints: a list of tag indexes representing the bast path
+        Args:
+            emissions (torch.Tensor): (batch_size, seq_len, nb_labels)
+            mask (Torch.FloatTensor): (batch_size, seq_len)
+
+        Returns:
+            torch.Tensor: the initial alphas. Shape of (batch_size, nb_labels)
+            torch.Tensor: (batch_size, seq_len - 1, nb_labels, nb_labels) matrices
+                from the tags at i - 1 (rows) to the tags at i (columns).
+                Padded positions hold the identity of the semiring, so they keep
+                the alphas unchanged.
         """
+        batch_size, seq_length, nb_labels = emissions.shape
+        alphas = self.transitions[self.BOS_TAG_ID, :].unsqueeze(0) + emissions[:, 0]
+        matrices = self.transitions.view(1, 1, nb_labels, nb_labels) + emissions[:, 1:].unsqueeze(2)
+        is_valid = mask[:, 1:].view(batch_size, seq_length - 1, 1, 1).bool()
+        matrices = torch.where(is_valid, matrices, semiring_identity(matrices))
+        return alphas, matrices
+
+    def _scan_log_partition(self, emissions, mask):
+        """Same as `_compute_log_partition`, with a parallel reduction over time."""
+        alphas, matrices = self._step_matrices(emissions, mask)
+        if matrices.shape[1] > 0:
+            product = semiring_tree(matrices, torch.logsumexp)[-1][:, 0]
+            alphas = semiring_vecmat(alphas, product, torch.logsumexp)
+        end_scores = alphas + self.transitions[:, self.EOS_TAG_ID].unsqueeze(0)
+        return torch.logsumexp(end_scores, dim=1)
 
-        # add the final best_tag to our best path
-        best_path = [best_tag]
+    def _scan_viterbi_decode(self, emissions, mask):
+        """Same as `_viterbi_decode`, with parallel scans over time: the max
+        alphas of all timesteps are computed by `semiring_scan` in the (max, +)
+        semiring, and the backpointers are followed by pointer jumping."""
+        batch_size, seq_length, nb_labels = emissions.shape
+        first_alphas, matrices = self._step_matrices(emissions, mask)
+        # (bs, seq_len, nb_labels)
+        alphas = semiring_scan(first_alphas, matrices, max_reduce)
 
-        # traverse the backpointers in backwards
-        for backpointers_t in reversed(backpointers):
+        end_scores = alphas[:, -1] + self.transitions[:, self.EOS_TAG_ID].unsqueeze(0)
+        max_final_scores, max_final_tags = torch.max(end_scores, dim=1)
+
+        # the best previous tag for each current tag, for all timesteps at once
+        # (the emissions of the current tags don't change the argmax)
+        # (bs, seq_len - 1, nb_labels)
+        scores = alphas[:, :-1].unsqueeze(3) + self.transitions.view(1, 1, nb_labels, nb_labels)
+        backpointers = torch.max(scores, dim=2)[1]
+        identity = torch.arange(nb_labels, device=emissions.device).view(1, 1, -1)
+        is_valid = mask[:, 1:].unsqueeze(-1).bool()
+        backpointers = torch.where(is_valid, backpointers, identity)
+
+        # compose the backpointers so that backpointers[:, i] sends the last
+        # tag straight to the tag at i, doubling the span at each step
+        span = 1
+        while span < seq_length - 1:
+            composed = backpointers[:, :-span].gather(2, backpointers[:, span:])
+            backpointers = torch.cat([composed, backpointers[:, -span:]], dim=1)
+            span *= 2
+
+        last_tags = max_final_tags.view(batch_size, 1, 1).expand(batch_size, seq_length - 1, 1)
+        best_sequences = torch.cat([backpointers.gather(2, last_tags).squeeze(2),
+                                    max_final_tags.unsqueeze(1)], dim=1)
+
+        pad_id = self.PAD_TAG_ID if self.PAD_TAG_ID is not None else 0
+        best_sequences = best_sequences.masked_fill(mask == 0, pad_id)
+        emission_lengths = mask.long().sum(dim=1)
+
+        return max_final_scores, best_sequences, emission_lengths
+
+
+# Semirings are given by their reduce function, like torch.logsumexp for the
+# (logsumexp, +) semiring of the forward algorithm or `max_reduce` for the
+# (max, +) semiring of the Viterbi algorithm.
+
+def max_reduce(x, dim):
+    return torch.max(x, dim)[0]
+
+
+def semiring_identity(matrices):
+    """Identity matrix of the semiring, with zeros in the diagonal and a big
+    negative number (a "log of zero") elsewhere."""
+    nb_labels = matrices.shape[-1]
+    identity = matrices.new_full((nb_labels, nb_labels), -10000.0)
+    return identity.fill_diagonal_(0.0)
+
+
+def semiring_vecmat(vectors, matrices, reduce):
+    # (..., n, 1) + (..., n, m) -> (..., m)
+    return reduce(vectors.unsqueeze(-1) + matrices, -2)
 
-            # recover the best_tag at this timestep
-            best_tag = backpointers_t[best_tag][sample_id].item()
 
-            # append to the beginning of the list so we don't need to reverse it later
-            best_path.insert(0, best_tag)
+def semiring_matmul(a, b, reduce, max_elements=2 ** 24):
+    # (..., n, k, 1) + (..., 1, k, m) -> (..., n, m), computed in chunks to
+    # bound the memory of the broadcasted (..., n, k, m) tensor
+    n, k = a.shape[-2:]
+    m = b.shape[-1]
+    shape = a.shape[:-2]
+    a = a.reshape(-1, n, k)
+    b = b.reshape(-1, k, m)
+    chunk_size = max(1, max_elements // (n * k * m))
+    products = [reduce(a[i:i + chunk_size].unsqueeze(3) + b[i:i + chunk_size].unsqueeze(1), -2)
+                for i in range(0, a.shape[0], chunk_size)]
+    return torch.cat(products, dim=0).view(*shape, n, m)
 
-        return best_path
+
+def semiring_tree(matrices, reduce):
+    """Multiply adjacent pairs of matrices until a single product is left.
+
+    Args:
+        matrices (torch.Tensor): (batch_size, seq_len, n, n)
+        reduce (callable): reduce function of the semiring
+
+    Returns:
+        list of torch.Tensor: the levels of the tree, from the matrices
+            (padded with identities to a power of two) to their product with
+            shape (batch_size, 1, n, n), in O(log seq_len) sequential steps.
+    """
+    batch_size, seq_length, n, _ = matrices.shape
+    padded_length = 1 << (seq_length - 1).bit_length()
+    if padded_length > seq_length:
+        identity = semiring_identity(matrices).expand(
+            batch_size, padded_length - seq_length, n, n)
+        matrices = torch.cat([matrices, identity], dim=1)
+    levels = [matrices]
+    while levels[-1].shape[1] > 1:
+        level = levels[-1]
+        levels.append(semiring_matmul(level[:, 0::2], level[:, 1::2], reduce))
+    return levels
+
+
+def semiring_scan(vectors, matrices, reduce):
+    """Parallel prefix products (Blelloch scan) of a vector times a sequence
+    of matrices.
+
+    The products of blocks of matrices are computed by `semiring_tree`, and
+    the vectors at the start of each block are then propagated down the tree
+    with vector-matrix products only, so both sweeps take O(log seq_len)
+    sequential steps and O(seq_len) matrix products.
+
+    Args:
+        vectors (torch.Tensor): (batch_size, n)
+        matrices (torch.Tensor): (batch_size, seq_len, n, n)
+        reduce (callable): reduce function of the semiring
+
+    Returns:
+        torch.Tensor: (batch_size, seq_len + 1, n) the vector times the first
+            i matrices, for i from 0 to seq_len.
+    """
+    batch_size, seq_length, n, _ = matrices.shape
+    if seq_length == 0:
+        return vectors.unsqueeze(1)
+    levels = semiring_tree(matrices, reduce)
+    # vectors at the start of each block of the current level
+    starts = vectors.unsqueeze(1)
+    for level in reversed(levels[:-1]):
+        # left blocks start like their parent, right blocks start after the
+        # product of their left sibling
+        rights = semiring_vecmat(starts, level[:, 0::2], reduce)
+        starts = torch.stack([starts, rights], dim=2).view(batch_size, -1, n)
+    ends = semiring_vecmat(starts[:, -1], levels[0][:, -1], reduce)
+    return torch.cat([starts, ends.unsqueeze(1)], dim=1)[:, :seq_length + 1]
+
+
+def forward_alphas(emissions, transitions, mask, bos_tag_id):
+    """Forward algorithm keeping the alphas of every timestep.
+
+    Args:
+        emissions (torch.Tensor): (batch_size, seq_len, nb_labels)
+        transitions (torch.Tensor): (nb_labels, nb_labels)
+        mask (torch.Tensor): (batch_size, seq_len) with the dtype of emissions
+        bos_tag_id (int): the beginning of sentence tag
+
+    Returns:
+        torch.Tensor: (seq_len, batch_size, nb_labels) the log-sum of the scores
+            of all paths from BOS to each label at each timestep. Padded
+            positions keep the alphas of the last valid one.
+    """
+    batch_size, seq_length, nb_labels = emissions.shape
+    alphas = emissions.new_empty(seq_length, batch_size, nb_labels)
+    alphas[0] = transitions[bos_tag_id].unsqueeze(0) + emissions[:, 0]
+    for i in range(1, seq_length):
+        scores = (alphas[i - 1].unsqueeze(2)
+                  + transitions.unsqueeze(0)
+                  + emissions[:, i].unsqueeze(1))
+        new_alphas = torch.logsumexp(scores, dim=1)
+        is_valid = mask[:, i].unsqueeze(-1)
+        alphas[i] = is_valid * new_alphas + (1 - is_valid) * alphas[i - 1]
+    return alphas
+
+
+def backward_betas(emissions, transitions, mask, eos_tag_id):
+    """Backward algorithm keeping the betas of every timestep.
+
+    Args:
+        emissions (torch.Tensor): (batch_size, seq_len, nb_labels)
+        transitions (torch.Tensor): (nb_labels, nb_labels)
+        mask (torch.Tensor): (batch_size, seq_len) with the dtype of emissions
+        eos_tag_id (int): the end of sentence tag
+
+    Returns:
+        torch.Tensor: (seq_len, batch_size, nb_labels) the log-sum of the scores
+            of all paths from each label at each timestep to EOS (excluding the
+            emissions of that timestep). Padded positions hold the transitions
+            to EOS.
+    """
+    batch_size, seq_length, nb_labels = emissions.shape
+    betas = emissions.new_empty(seq_length, batch_size, nb_labels)
+    betas[-1] = transitions[:, eos_tag_id].unsqueeze(0)
+    for i in range(seq_length - 1, 0, -1):
+        # (bs, nb_labels, nb_labels) from the tags at i - 1 to the tags at i
+        scores = (transitions.unsqueeze(0)
+                  + (emissions[:, i] + betas[i]).unsqueeze(1))
+        new_betas = torch.logsumexp(scores, dim=2)
+        is_valid = mask[:, i].unsqueeze(-1)
+        betas[i - 1] = is_valid * new_betas + (1 - is_valid) * betas[i]
+    return betas
+
+
+class LogPartition(torch.autograd.Function):
+    """Log partition function of a linear-chain CRF computed with the forward
+    algorithm, like `CRF._compute_log_partition`, but with a hand-written
+    backward.
+
+    Autograd would keep the (batch_size, nb_labels, nb_labels) scores of every
+    timestep. Here only the alphas are saved, and the backward pass computes the
+    betas to get the gradients from the marginals: the gradient of the
+    emissions are the unary marginals and the gradient of the transitions are
+    the pairwise marginals summed over the batch and timesteps.
+    """
+
+    @staticmethod
+    def forward(ctx, emissions, transitions, mask, bos_tag_id, eos_tag_id):
+        mask = mask.to(emissions.dtype)
+        alphas = forward_alphas(emissions, transitions, mask, bos_tag_id)
+        end_scores = alphas[-1] + transitions[:, eos_tag_id].unsqueeze(0)
+        log_partition = torch.logsumexp(end_scores, dim=1)
+
+        ctx.save_for_backward(emissions, transitions, mask, alphas,
+                              log_partition)
+        ctx.bos_tag_id = bos_tag_id
+        ctx.eos_tag_id = eos_tag_id
+        return log_partition
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        emissions, transitions, mask, alphas, log_partition = ctx.saved_tensors
+        seq_length = emissions.shape[1]
+        # the marginals are scaled by the gradient of each sequence
+        weights = grad_output.unsqueeze(1)
+        log_z = log_partition.unsqueeze(1)
+
+        grad_emissions = torch.zeros_like(emissions)
+        grad_transitions = torch.zeros_like(transitions)
+
+        # marginals of the last tags, which transition to EOS
+        last_transition = transitions[:, ctx.eos_tag_id].unsqueeze(0)
+        end_marginals = torch.exp(alphas[-1] + last_transition - log_z)
+        grad_transitions[:, ctx.eos_tag_id] = (weights * end_marginals).sum(0)
+
+        # betas are computed backwards from the last transition and are
+        # kept unchanged over padded positions, just like the alphas
+        betas = last_transition.expand_as(alphas[-1])
+        for i in range(seq_length - 1, 0, -1):
+            is_valid = mask[:, i].unsqueeze(-1)
+
+            # unary marginals of the tags at timestep i
+            marginals = torch.exp(alphas[i] + betas - log_z)
+            grad_emissions[:, i] = weights * is_valid * marginals
+
+            # (bs, nb_labels, nb_labels) scores from the tags at i - 1 (rows)
+            # to the tags at i (columns), only alive during this step
+            scores = (transitions.unsqueeze(0)
+                      + (emissions[:, i] + betas).unsqueeze(1))
+            pairwise = torch.exp(alphas[i - 1].unsqueeze(2) + scores
+                                 - log_z.unsqueeze(2))
+            pairwise_weights = (weights * is_valid).unsqueeze(2)
+            grad_transitions += (pairwise_weights * pairwise).sum(0)
+
+            new_betas = torch.logsumexp(scores, dim=2)
+            betas = is_valid * new_betas + (1 - is_valid) * betas
+
+        # the first timestep is always valid and comes from BOS
+        marginals = torch.exp(alphas[0] + betas - log_z)
+        grad_emissions[:, 0] = weights * marginals
+        grad_transitions[ctx.bos_tag_id] += (weights * marginals).sum(0)
+
+        return grad_emissions, grad_transitions, None, None, None
+
+
+class FixedLagDecoder:
+    """Online Viterbi decoding for streams of emissions with no sentence
+    boundaries.
+
+    Emissions are pushed as they arrive, and the tag of each position is
+    committed once `lag` newer positions were seen, following the backpointers
+    from the current best label. Only the backpointers of the last `lag`
+    positions are kept, so memory is bounded and tags come out with a latency of
+    `lag` positions. Committed tags are never revised: they match the Viterbi
+    path of the whole stream as long as later emissions don't change the best
+    path more than `lag` positions back. With `lag=0` decoding is greedy.
+
+    Args:
+        crf (CRF): the CRF whose transitions are used.
+        lag (int): number of positions kept before committing a tag.
+
+    Example:
+        decoder = crf.stream_decoder(lag=8)
+        for emissions in stream:  # (batch_size, n, nb_labels) chunks
+            emit(decoder.push(emissions))
+        emit(decoder.flush())
+    """
+
+    def __init__(self, crf, lag):
+        if lag < 0:
+            raise Exception('The lag should be a non-negative number.')
+        self.crf = crf
+        self.lag = lag
+        self.reset()
+
+    def reset(self):
+        """Start a new stream."""
+        # (bs, nb_labels) scores of the best paths ending at each label
+        self.alphas = None
+        # (bs, nb_labels) best previous label of each label, for each position
+        # not committed yet except the first one
+        self.backpointers = deque()
+        self.nb_pending = 0
+
+    def push(self, emissions):
+        """Consume the next emissions of the stream.
+
+        Args:
+            emissions (torch.Tensor): (batch_size, n, nb_labels)
+
+        Returns:
+            torch.LongTensor: (batch_size, m) the tags committed by these
+                emissions, which follow the tags committed before.
+        """
+        # the scores are only kept for decoding, so no graph is built
+        # across the stream
+        with torch.no_grad():
+            transitions = self.crf.transitions
+            committed = []
+            for i in range(emissions.shape[1]):
+                if self.alphas is None:
+                    self.alphas = transitions[self.crf.BOS_TAG_ID].unsqueeze(0) + emissions[:, i]
+                else:
+                    scores = (self.alphas.unsqueeze(2)
+                              + transitions.unsqueeze(0)
+                              + emissions[:, i].unsqueeze(1))
+                    self.alphas, max_score_tags = torch.max(scores, dim=1)
+                    # pointers to committed positions are not needed
+                    if self.nb_pending > 0:
+                        self.backpointers.append(max_score_tags)
+                self.nb_pending += 1
+                if self.nb_pending > self.lag:
+                    best_tags = torch.max(self.alphas, dim=1)[1]
+                    committed.append(self._backtrace(best_tags)[:, :1])
+                    if self.backpointers:
+                        self.backpointers.popleft()
+                    self.nb_pending -= 1
+        if committed:
+            return torch.cat(committed, dim=1)
+        return emissions.new_zeros(emissions.shape[0], 0, dtype=torch.long)
+
+    def flush(self):
+        """End the stream, adding the transitions to EOS, and return the tags
+        not committed yet as a (batch_size, m) tensor. The decoder is then
+        reset for a new stream."""
+        if self.alphas is None:
+            return torch.zeros(0, 0, dtype=torch.long)
+        if self.nb_pending == 0:
+            tags = self.alphas.new_zeros(self.alphas.shape[0], 0, dtype=torch.long)
+            self.reset()
+            return tags
+        with torch.no_grad():
+            last_transition = self.crf.transitions[:, self.crf.EOS_TAG_ID]
+            end_scores = self.alphas + last_transition.unsqueeze(0)
+            best_tags = torch.max(end_scores, dim=1)[1]
+            tags = self._backtrace(best_tags)
+        self.reset()
+        return tags
+
+    def _backtrace(self, best_tags):
+        # tags of all positions not committed yet, from the oldest one
+        best_tags = best_tags.unsqueeze(1)
+        best_sequence = [best_tags]
+        for backpointers_t in reversed(self.backpointers):
+            best_tags = backpointers_t.gather(1, best_tags)
+            best_sequence.append(best_tags)
+        best_sequence.reverse()
+        return torch.cat(best_sequence, dim=1)
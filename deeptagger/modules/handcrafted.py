@@ -35,7 +35,7 @@ class HandCrafted(nn.Module):
             self.prefixes_emb = nn.Embedding(
                 num_embeddings=len(self.prefixes_field.vocab),
                 embedding_dim=options.prefix_embeddings_size,
-                padding_idx=constants.PAD_ID,
+                padding_idx=self.prefixes_field.vocab.stoi[constants.PAD],
             )
             self.prefix_length = (
                 options.prefix_max_length - options.prefix_min_length + 1
@@ -48,7 +48,7 @@ class HandCrafted(nn.Module):
             self.suffixes_emb = nn.Embedding(
                 num_embeddings=len(self.suffixes_field.vocab),
                 embedding_dim=options.suffix_embeddings_size,
-                padding_idx=constants.PAD_ID,
+                padding_idx=self.suffixes_field.vocab.stoi[constants.PAD],
             )
             self.suffix_length = (
                 options.suffix_max_length - options.suffix_min_length + 1
@@ -61,7 +61,7 @@ class HandCrafted(nn.Module):
             self.caps_emb = nn.Embedding(
                 num_embeddings=len(self.caps_field.vocab),
                 embedding_dim=options.caps_embeddings_size,
-                padding_idx=constants.PAD_ID,
+                padding_idx=self.caps_field.vocab.stoi[constants.PAD],
             )
             self.caps_length = 1
             self.features_size += options.caps_embeddings_size
@@ -1,34 +1,29 @@
 from pathlib import Path
 
 import torch
-import adabound
 
 from deeptagger import constants
 from deeptagger import opts
-from deeptagger.modules.optim.adamw import AdamW
-from deeptagger.modules.optim.step_decay_optimizer import StepDecayOptimizer
-from deeptagger.modules.optim.lr_scheduler import (NoamDecayScheduler,
-                                                   ExpDecayScheduler,
-                                                   RsqrtDecayScheduler)
-
-available_optimizers = {
-    'adam': torch.optim.Adam,
-    'adadelta': torch.optim.Adadelta,
-    'adagrad': torch.optim.Adagrad,
-    'adamax': torch.optim.Adamax,
-    'sparseadam': torch.optim.SparseAdam,
-    'sgd': torch.optim.SGD,
-    'asgd': torch.optim.ASGD,
-    'rmsprop': torch.optim.RMSprop,
-    'adabound': adabound.AdaBound,
-    'adamw': AdamW,
-}
-
-available_step_decays = {
-    'noam': NoamDecayScheduler,
-    'exp': ExpDecayScheduler,
-    'rsqrt': RsqrtDecayScheduler
-}
+from deeptagger.lazy import LazyDict
+
+available_optimizers = LazyDict({
+    'adam': 'torch.optim.Adam',
+    'adadelta': 'torch.optim.Adadelta',
+    'adagrad': 'torch.optim.Adagrad',
+    'adamax': 'torch.optim.Adamax',
+    'sparseadam': 'torch.optim.SparseAdam',
+    'sgd': 'torch.optim.SGD',
+    'asgd': 'torch.optim.ASGD',
+    'rmsprop': 'torch.optim.RMSprop',
+    'adabound': 'adabound.AdaBound',
+    'adamw': 'deeptagger.modules.optim.adamw.AdamW',
+})
+
+available_step_decays = LazyDict({
+    'noam': 'deeptagger.modules.optim.lr_scheduler.NoamDecayScheduler',
+    'exp': 'deeptagger.modules.optim.lr_scheduler.ExpDecayScheduler',
+    'rsqrt': 'deeptagger.modules.optim.lr_scheduler.RsqrtDecayScheduler'
+})
 
 
 def build_step_decay_wrapper(options, optim):
@@ -51,6 +46,8 @@ def build_step_decay_wrapper(options, optim):
     lr_scheduler_sd = lr_scheduler_sd_class(**kwargs)
 
     # wrapper the optimizer together with the lr scheduler
+    from deeptagger.modules.optim.step_decay_optimizer import \
+        StepDecayOptimizer
     wrapped_optim = StepDecayOptimizer(optim, lr_scheduler_sd)
 
     return wrapped_optim
@@ -103,8 +100,9 @@ def load_state(path, optim):
     optim.load_state_dict(torch.load(str(optim_path)))
 
 
-def load(path, model_parameters):
-    options = opts.load(path)
+def load(path, model_parameters, options=None):
+    if options is None:
+        options = opts.load(path)
     optim = build(options, model_parameters)
     load_state(path, optim)
     return optim
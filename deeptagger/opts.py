@@ -8,6 +8,9 @@ from deeptagger import optimizer
 from deeptagger import scheduler
 from deeptagger.dataset.fields import available_embeddings
 
+# used when --dev-batch-size is not given (and there is no autotuned one)
+DEFAULT_DEV_BATCH_SIZE = 64
+
 
 def load(path):
     config_path = Path(path, constants.CONFIG)
@@ -42,6 +45,20 @@ def general_opts(parser):
                        default=None,
                        type=int,
                        help='Use CUDA on the listed devices')
+    # Threads
+    group = parser.add_argument_group('threads')
+    group.add_argument('--num-threads',
+                       default=None,
+                       type=int,
+                       help='Number of threads used by torch inside each '
+                            'op (intra-op parallelism). Default is the '
+                            'number of physical cores')
+    group.add_argument('--num-interop-threads',
+                       default=None,
+                       type=int,
+                       help='Number of threads used by torch to run '
+                            'independent ops in parallel (inter-op '
+                            'parallelism)')
     # Logging
     group = parser.add_argument_group('logging')
     group.add_argument('--debug',
@@ -57,11 +74,13 @@ def general_opts(parser):
     group.add_argument('--save',
                        type=str,
                        default=None,
-                       help='Output dir for saving the model')
+                       help='Output dir for saving the model (or output '
+                            'file when creating a bundle)')
     group.add_argument('--load',
                        type=str,
                        default=None,
-                       help='Input dir for loading the model')
+                       help='Input dir for loading the model. For '
+                            'predicting, it can also be a bundle file')
     group.add_argument('--resume-epoch',
                        type=int,
                        default=None,
@@ -120,6 +139,14 @@ def preprocess_opts(parser):
                        action='store_true',
                        help='Add words from embeddings vocabulary to '
                             'source/target vocabulary.')
+    group.add_argument('--tag-dictionary',
+                       type=int,
+                       default=None,
+                       help='Build a tag dictionary from the training data, '
+                            'restricting the predicted tags of words seen at '
+                            'least this many times to the tags they were '
+                            'seen with. It is saved with the model. Other '
+                            'words can get any tag.')
 
     # Embeddings options
     group = parser.add_argument_group('data-embeddings')
@@ -258,8 +285,11 @@ def train_opts(parser):
                        help='Maximum batch size for training.')
     group.add_argument('--dev-batch-size',
                        type=int,
-                       default=64,
-                       help='Maximum batch size for evaluating.')
+                       default=None,
+                       help='Maximum batch size for evaluating and '
+                            'predicting. By default, {} or the autotuned '
+                            'one when predicting.'.format(
+                                DEFAULT_DEV_BATCH_SIZE))
     group.add_argument('--dev-checkpoint-epochs',
                        type=int,
                        default=1,
@@ -398,11 +428,131 @@ def predict_opts(parser):
                        help='A text to be predicted. '
                             'The text will be splited into sentences '
                             'ending with .?!')
+    group.add_argument('--pipe',
+                       action='store_true',
+                       help='Read sentences from stdin, one per line with '
+                            'tokens separated by spaces, and write their '
+                            'predictions to stdout as soon as each batch is '
+                            'predicted. A batch holds the lines already '
+                            'available, up to `--dev-batch-size`. Only for '
+                            'the `text`, `topk` and `conll` output formats.')
     group.add_argument('--prediction-type',
                        type=str,
                        default='classes',
                        choices=['classes', 'probas'],
                        help='Whether to predict classes or probabilities.')
+    group.add_argument('--output-format',
+                       type=str,
+                       default='text',
+                       choices=['text', 'topk', 'conll', 'npy', 'npz'],
+                       help='Format of the predictions saved in the output '
+                            'dir. `text`: one sentence per line. `topk`: '
+                            'top-k tags with probabilities. `conll`: one '
+                            'token per line with index, word and tag columns. '
+                            '`npy` and `npz`: a flat array with the '
+                            'predictions of all tokens and an array with the '
+                            'offsets of each sentence.')
+    group.add_argument('--top-k',
+                       type=int,
+                       default=3,
+                       help='Number of tags written for each token when '
+                            '`--output-format` is `topk`.')
+    group.add_argument('--probas-dtype',
+                       type=str,
+                       default='float32',
+                       choices=['float16', 'float32'],
+                       help='Data type of the probabilities saved with the '
+                            '`npy` and `npz` output formats.')
+    group.add_argument('--num-workers',
+                       type=int,
+                       default=None,
+                       help='Number of processes used to predict the file '
+                            'in `--test-path`. The file is split into shards '
+                            'that are predicted in parallel by each worker. '
+                            'Default is the autotuned value or 1.')
+    group.add_argument('--chunk-size',
+                       type=int,
+                       default=2048,
+                       help='Number of sentences of `--test-path` that are '
+                            'read, predicted and written at once.')
+    group.add_argument('--queue-size',
+                       type=int,
+                       default=4,
+                       help='Max number of chunks waiting between two '
+                            'prediction stages (reading, predicting and '
+                            'writing).')
+    group.add_argument('--cache-dir',
+                       type=str,
+                       default=None,
+                       help='Directory of a persistent cache of predictions. '
+                            'Sentences already predicted by the same model '
+                            'are read from the cache instead of being '
+                            'predicted again.')
+    group.add_argument('--quantize',
+                       action='store_true',
+                       help='Apply dynamic int8 quantization to the LSTM/GRU '
+                            'and linear layers before predicting. '
+                            'Only available on CPU.')
+    group.add_argument('--no-autotune',
+                       action='store_true',
+                       help='Ignore the config saved by `autotune` for the '
+                            'loaded model. Otherwise, its batch size, number '
+                            'of threads and workers are used when '
+                            '`--dev-batch-size`, `--num-threads` and '
+                            '`--num-workers` are not given.')
+
+
+def batch_opts(parser):
+    # Batch job options
+    group = parser.add_argument_group('batch')
+    group.add_argument('--input',
+                       type=str,
+                       default=None,
+                       help='Directory (walked recursively) or glob pattern '
+                            '(e.g. `corpus/**/*.txt`) of the files tagged by '
+                            'the `batch` task, in the same format as '
+                            '`--test-path`. The predictions of each file are '
+                            'saved in `--output-dir` under its relative '
+                            'path. Run it again with the same `--output-dir` '
+                            'to resume an interrupted job.')
+    group.add_argument('--concurrent-files',
+                       type=int,
+                       default=4,
+                       help='Number of files read and written at the same '
+                            'time. Their sentences are predicted together '
+                            'in shared batches.')
+
+
+def autotune_opts(parser):
+    # Autotuning options
+    group = parser.add_argument_group('autotune')
+    group.add_argument('--autotune-batch-sizes',
+                       type=int,
+                       nargs='+',
+                       default=[1, 8, 32, 64, 128],
+                       help='Batch sizes to try.')
+    group.add_argument('--autotune-threads',
+                       type=int,
+                       nargs='+',
+                       default=None,
+                       help='Numbers of threads per worker to try. Default '
+                            'is powers of 2 up to the number of cpus.')
+    group.add_argument('--autotune-workers',
+                       type=int,
+                       nargs='+',
+                       default=None,
+                       help='Numbers of workers to try. Default is powers '
+                            'of 2 up to the number of cpus.')
+    group.add_argument('--autotune-max-sentences',
+                       type=int,
+                       default=2000,
+                       help='Maximum number of sentences of `--test-path` '
+                            'used as sample input.')
+    group.add_argument('--autotune-max-p99',
+                       type=float,
+                       default=None,
+                       help='Only recommend configurations whose p99 '
+                            'latency (in milliseconds) is below this value.')
 
 
 def get_default_args():
@@ -413,5 +563,7 @@ def get_default_args():
     model_opts(parser)
     train_opts(parser)
     predict_opts(parser)
+    batch_opts(parser)
+    autotune_opts(parser)
     args = parser.parse_args()
     return vars(args)
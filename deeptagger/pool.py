@@ -0,0 +1,153 @@
+import gc
+import math
+import multiprocessing
+
+import numpy as np
+import torch
+
+from deeptagger import cache
+
+# taggers inherited by the forked workers (indexed by pool), so their
+# weights are shared copy-on-write with the parent instead of being pickled
+_worker_state = {}
+
+# caches inherited from the parent, which are replaced in the workers but
+# kept alive, so their sqlite connections are never touched after the fork
+_inherited_caches = []
+
+
+class TaggerPool:
+    """Predict with a pool of processes forked from a loaded tagger.
+
+    The tagger is loaded and warmed up once in the parent, then the workers
+    are forked and share its weights copy-on-write, so starting N workers
+    takes neither N loads nor N times the memory. Each worker also runs a
+    small warmup batch before accepting work, so the first requests don't
+    pay for lazy initializations. Only available on CPU.
+
+    By default, the number of workers and the threads of each worker are
+    the autotuned ones (see `autotune.run`). Otherwise, there is 1 worker
+    and the threads of the tagger are split between the workers.
+
+    Note that with GNU OpenMP, forked workers hang if the parent has already
+    predicted with several threads, so the pool should be created before
+    using the tagger in the parent (the warmup runs on a single thread).
+
+    Example:
+        tagger = Tagger()
+        tagger.load('path/to/model-dir/', inference=True)
+        with TaggerPool(tagger, num_workers=4) as pool:
+            tags = pool.predict_classes(texts)
+    """
+
+    def __init__(self, tagger, num_workers=None, num_threads=None,
+                 warmup=True):
+        if tagger.gpu_id is not None:
+            raise Exception('Multiple workers are only available on CPU.')
+        if num_workers is None:
+            num_workers = 1
+            if tagger.autotune_config is not None:
+                num_workers = tagger.autotune_config['num_workers']
+        if num_threads is None:
+            num_threads = max(1, torch.get_num_threads() // num_workers)
+            config = tagger.autotune_config
+            if config is not None and tagger.num_threads is None:
+                num_threads = config['num_threads']
+        if warmup:
+            parent_threads = torch.get_num_threads()
+            torch.set_num_threads(1)
+            try:
+                tagger.warmup()
+            finally:
+                torch.set_num_threads(parent_threads)
+        self.num_workers = num_workers
+        self.batch_size = tagger.batch_size
+        self.key = id(self)
+        _worker_state[self.key] = tagger
+        # objects tracked by the gc are written when collecting, which would
+        # copy their pages in every worker, so we move them out of its reach
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        context = multiprocessing.get_context('fork')
+        self.pool = context.Pool(num_workers,
+                                 initializer=_init_worker,
+                                 initargs=(self.key, num_threads, warmup))
+        if hasattr(gc, 'unfreeze'):
+            gc.unfreeze()
+
+    def predict(self, texts, batch_size=None, prediction_type='classes',
+                return_type='list'):
+        """Same as `Tagger.predict`, but the texts are split into chunks that
+        are predicted in parallel by the workers."""
+        if batch_size is None:
+            batch_size = self.batch_size
+        if isinstance(texts, str):
+            predictions = self.predict([texts], batch_size, prediction_type,
+                                       return_type)
+            return predictions[0] if return_type == 'list' else predictions
+        texts = list(texts)
+        if not texts:
+            # nothing to send to the workers
+            return _worker_state[self.key].predict(texts, batch_size,
+                                                   prediction_type,
+                                                   return_type)
+        chunk_size = max(batch_size,
+                         math.ceil(len(texts) / self.num_workers))
+        chunks = [texts[i:i + chunk_size]
+                  for i in range(0, len(texts), chunk_size)]
+        args = [(self.key, chunk, batch_size, prediction_type, return_type)
+                for chunk in chunks]
+        results = self.pool.starmap(_predict_chunk, args)
+        if return_type == 'numpy':
+            return _concat(results)
+        return [pred for chunk_preds in results for pred in chunk_preds]
+
+    def predict_classes(self, texts, batch_size=None, return_type='list'):
+        return self.predict(texts, batch_size, prediction_type='classes',
+                            return_type=return_type)
+
+    def predict_probas(self, texts, batch_size=None, return_type='list'):
+        return self.predict(texts, batch_size, prediction_type='probas',
+                            return_type=return_type)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        _worker_state.pop(self.key, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _init_worker(key, num_threads, warmup):
+    torch.set_num_threads(num_threads)
+    tagger = _worker_state[key]
+    if tagger.cache is not None:
+        # sqlite connections can't be used across fork(), so each worker
+        # opens its own
+        _inherited_caches.append(tagger.cache)
+        tagger.cache = cache.PredictionCache(tagger.cache_dir,
+                                             tagger.cache.model_hash,
+                                             tagger.cache.nb_labels)
+    if warmup:
+        tagger.warmup(batch_sizes=(1,), lengths=(8,))
+
+
+def _predict_chunk(key, texts, batch_size, prediction_type, return_type):
+    return _worker_state[key].predict(texts,
+                                      batch_size=batch_size,
+                                      prediction_type=prediction_type,
+                                      return_type=return_type)
+
+
+def _concat(results):
+    # shift the offsets of each chunk by the number of tokens before it
+    flats, offsets = zip(*results)
+    all_offsets = [offsets[0]]
+    for chunk_offsets in offsets[1:]:
+        all_offsets.append(chunk_offsets[1:] + all_offsets[-1][-1])
+    return np.concatenate(flats), np.concatenate(all_offsets)
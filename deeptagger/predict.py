@@ -1,67 +1,428 @@
+import itertools
 import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import threading
 from pathlib import Path
 
+import numpy as np
+import torch
+
+from deeptagger import autotune
+from deeptagger import bundle
+from deeptagger import cache
+from deeptagger import config_utils
 from deeptagger import constants
 from deeptagger.dataset import dataset, fields
+from deeptagger.dataset.corpus import Corpus
 from deeptagger import features
 from deeptagger import iterator
 from deeptagger import models
+from deeptagger import opts
 from deeptagger.predicter import Predicter
+from deeptagger import writer
+from deeptagger.writer import (transform_predictions,  # NOQA
+                               transform_classes_to_tags,
+                               transform_predictions_to_text)
 
 
 def run(options):
-    words_field = fields.WordsField()
-    tags_field = fields.TagsField()
-    fields_tuples = [('words', words_field), ('tags', tags_field)]
-    fields_tuples += features.load(options.load)
+    nb_inputs = sum([options.test_path is not None,
+                     options.text is not None,
+                     options.pipe])
+    if nb_inputs == 0:
+        raise Exception('You should inform a path to test data, a text or '
+                        'use --pipe.')
 
-    if options.test_path is None and options.text is None:
-        raise Exception('You should inform a path to test data or a text.')
+    if nb_inputs > 1:
+        raise Exception('You cant inform more than one of a path to test '
+                        'data, a text or --pipe.')
 
-    if options.test_path is not None and options.text is not None:
-        raise Exception('You cant inform both a path to test data or a text.')
+    configure_autotune(options)
 
-    dataset_iter = None
-    if options.test_path is not None:
-        logging.info('Building test dataset: {}'.format(options.test_path))
-        test_tuples = list(filter(lambda x: x[0] != 'tags', fields_tuples))
-        test_dataset = dataset.build(options.test_path, test_tuples, options)
+    if options.num_workers > 1 and options.gpu_id is not None:
+        raise Exception('Multiple workers are only available on CPU.')
 
-        logging.info('Building test iterator...')
-        dataset_iter = iterator.build(test_dataset, options.gpu_id,
-                                      options.dev_batch_size, is_train=False)
+    fields_tuples, model = load_model(options)
+    tags_field = dict(fields_tuples)['tags']
+    test_tuples = list(filter(lambda x: x[0] != 'tags', fields_tuples))
+    prediction_cache = open_cache(options, fields_tuples, model)
 
     if options.text is not None:
         logging.info('Preparing text...')
-        test_tuples = list(filter(lambda x: x[0] != 'tags', fields_tuples))
         test_dataset = dataset.build_texts(options.text, test_tuples, options)
 
-        logging.info('Building iterator...')
-        dataset_iter = iterator.build(test_dataset, options.gpu_id,
-                                      options.dev_batch_size, is_train=False)
+        if prediction_cache is not None:
+            predictions = cache.predict(prediction_cache, test_dataset, model,
+                                        options.prediction_type,
+                                        options.dev_batch_size,
+                                        options.gpu_id)
+            predictions = cache.format_predictions(predictions, 'list')
+        else:
+            logging.info('Building iterator...')
+            dataset_iter = iterator.build_sorted(test_dataset, options.gpu_id,
+                                                 options.dev_batch_size)
+            predicter = Predicter(dataset_iter, model)
+            predictions = predicter.predict(options.prediction_type)
+        predictions_str = transform_predictions_to_text(
+            transform_predictions(tags_field, predictions,
+                                  options.prediction_type)
+        )
+        logging.info(options.text)
+        logging.info(predictions_str)
+        return predictions
 
-    logging.info('Loading vocabularies...')
-    fields.load_vocabs(options.load, fields_tuples)
+    # top-k tags are drawn from the probabilities
+    if options.output_format == 'topk':
+        options.prediction_type = 'probas'
 
-    logging.info('Loading model...')
-    model = models.load(options.load, fields_tuples)
+    if options.pipe:
+        logging.info('Predicting sentences from stdin...')
+        predict_stream(options, test_tuples, tags_field, model, sys.stdin,
+                       sys.stdout, prediction_cache=prediction_cache)
+        if prediction_cache is not None:
+            prediction_cache.close()
+        return
+
+    logging.info('Predicting {}...'.format(options.test_path))
+    if options.num_workers > 1:
+        predict_shards(options, test_tuples, tags_field, model,
+                       prediction_cache)
+    else:
+        with writer.build(options, tags_field, options.output_dir) as w:
+            predict_file(options, test_tuples, model, w,
+                         prediction_cache=prediction_cache)
+    if prediction_cache is not None:
+        logging.info('Prediction cache: {} hits, {} misses'.format(
+            prediction_cache.hits, prediction_cache.misses))
+        prediction_cache.close()
+    logging.info('Predictions saved in {}'.format(options.output_dir))
+
+
+def load_model(options):
+    """Load the model in `options.load` (a directory or a bundle) along with
+    the fields of its vocabularies."""
+    words_field = fields.WordsField()
+    tags_field = fields.TagsField()
+    fields_tuples = [('words', words_field), ('tags', tags_field)]
+
+    if options.quantize and options.gpu_id is not None:
+        raise Exception('Quantized models can only be used on CPU.')
+
+    if bundle.is_bundle(options.load):
+        logging.info('Loading bundle...')
+        _, model = bundle.load(options.load, fields_tuples, options.gpu_id)
+    else:
+        model_options = opts.load(options.load)
+        model_options.gpu_id = options.gpu_id
+        fields_tuples += features.build(model_options)
 
+        logging.info('Loading vocabularies...')
+        fields.load_vocabs(options.load, fields_tuples)
+
+        logging.info('Loading model...')
+        model = models.load(options.load, fields_tuples, model_options)
+
+    if options.quantize:
+        logging.info('Quantizing model...')
+        model = models.quantize(model)
+
+    return fields_tuples, model
+
+
+def open_cache(options, fields_tuples, model):
+    """Return the prediction cache in `options.cache_dir`, if any."""
+    if options.cache_dir is None:
+        return None
+    logging.info('Opening prediction cache: {}'.format(options.cache_dir))
+    tags_field = dict(fields_tuples)['tags']
+    return cache.PredictionCache(options.cache_dir,
+                                 cache.model_hash(model, fields_tuples),
+                                 len(tags_field.vocab))
+
+
+def predict_dataset(options, text_dataset, model, prediction_cache=None):
+    """Predict all examples of `text_dataset` in length-sorted batches.
+
+    Returns:
+        list of np.ndarray: predictions for each example, in dataset order
+    """
+    if prediction_cache is not None:
+        return cache.predict(prediction_cache, text_dataset, model,
+                             options.prediction_type, options.dev_batch_size,
+                             options.gpu_id)
+    dataset_iter = iterator.build_sorted(text_dataset, options.gpu_id,
+                                         options.dev_batch_size)
     predicter = Predicter(dataset_iter, model)
-    predictions = predicter.predict(options.prediction_type)
+    flat, offsets = predicter.predict(options.prediction_type, 'numpy')
+    return np.split(flat, offsets[1:-1])
 
-    if options.prediction_type == 'classes':
-        prediction_tags = transform_classes_to_tags(tags_field, predictions)
-        predictions_str = transform_predictions_to_text(prediction_tags)
-    elif options.prediction_type == 'probas':
-        predictions_str = transform_predictions_to_text(predictions)
 
-    if options.text is None:
-        save_predictions(options.output_dir, predictions_str)
+def configure_autotune(options):
+    """Use the batch size, threads and workers recommended by `autotune`
+    for the loaded model. Values given by the user are kept."""
+    config = None
+    if not options.no_autotune:
+        config = autotune.load_config(options.load)
+    if config is not None:
+        logging.info('Using autotuned config: batch size {batch_size}, '
+                     '{num_threads} threads, {num_workers} workers'.format(
+                         **config))
+        if options.dev_batch_size is None:
+            options.dev_batch_size = config['batch_size']
+        if options.num_workers is None:
+            options.num_workers = config['num_workers']
+        # the workers split the threads of the main process
+        if options.num_threads is None:
+            options.num_threads = config['num_threads'] * options.num_workers
+            config_utils.configure_threads(options.num_threads)
+    if options.dev_batch_size is None:
+        options.dev_batch_size = opts.DEFAULT_DEV_BATCH_SIZE
+    if options.num_workers is None:
+        options.num_workers = 1
+
+
+# marks the end of the stream of chunks passed between pipeline stages
+_END = object()
+
+
+def predict_file(options, fields_tuples, model, prediction_writer,
+                 byte_range=None, prediction_cache=None):
+    """Predict the sentences of `options.test_path` and write them with
+    `prediction_writer` in a pipeline of three stages running concurrently:
+
+        reading -> model forward -> writing
+
+    The file is processed in chunks of `options.chunk_size` sentences and
+    at most `options.queue_size` chunks are kept between two stages, so
+    memory doesn't grow with the size of the file.
+
+    If `prediction_cache` is given, only the sentences missing from the
+    cache are predicted.
+    """
+    read_queue = queue.Queue(maxsize=options.queue_size)
+    write_queue = queue.Queue(maxsize=options.queue_size)
+    errors = []
+    # asks the reader to stop early when a later stage fails
+    stop_reading = threading.Event()
+
+    def read_stage():
+        try:
+            lines = Corpus.iter_lines(options.test_path, byte_range)
+            while not stop_reading.is_set():
+                chunk = list(itertools.islice(lines, options.chunk_size))
+                if not chunk:
+                    break
+                chunk_dataset = dataset.build_tagged_texts(chunk,
+                                                           fields_tuples,
+                                                           options)
+                if prediction_cache is not None:
+                    read_queue.put((chunk, chunk_dataset))
+                    continue
+                dataset_iter = iterator.build_sorted(chunk_dataset,
+                                                     options.gpu_id,
+                                                     options.dev_batch_size)
+                # numericalize and pad batches here to unload the forward
+                dataset_iter.prefetch()
+                read_queue.put((chunk, dataset_iter))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            read_queue.put(_END)
+
+    def write_stage():
+        try:
+            for chunk, predictions in iter(write_queue.get, _END):
+                prediction_writer.write(chunk, predictions)
+        except Exception as e:
+            errors.append(e)
+            # keep consuming so the forward stage is never blocked
+            for _ in iter(write_queue.get, _END):
+                pass
+
+    read_thread = threading.Thread(target=read_stage, daemon=True)
+    write_thread = threading.Thread(target=write_stage, daemon=True)
+    read_thread.start()
+    write_thread.start()
+    finished_reading = False
+    try:
+        for chunk, data in iter(read_queue.get, _END):
+            if errors:
+                break
+            if prediction_cache is not None:
+                predictions = cache.predict(prediction_cache, data, model,
+                                            options.prediction_type,
+                                            options.dev_batch_size,
+                                            options.gpu_id)
+                predictions = cache.format_predictions(
+                    predictions, prediction_writer.return_type)
+            else:
+                predicter = Predicter(data, model)
+                predictions = predicter.predict(options.prediction_type,
+                                                prediction_writer.return_type)
+            write_queue.put((chunk, predictions))
+        else:
+            finished_reading = True
+    finally:
+        write_queue.put(_END)
+        write_thread.join()
+        if not finished_reading:
+            # the reader may be blocked on a full queue, so we consume its
+            # chunks until it stops
+            stop_reading.set()
+            for _ in iter(read_queue.get, _END):
+                pass
+        read_thread.join()
+    if errors:
+        raise errors[0]
+
+
+def predict_stream(options, fields_tuples, tags_field, model, input_stream,
+                   output_stream, prediction_cache=None):
+    """Predict the sentences read from `input_stream` (one per line, with
+    tokens separated by spaces) and write their predictions to
+    `output_stream` in the same order, one batch at a time.
+
+    Lines are read in a background thread, and each batch holds the lines
+    already read (up to `options.dev_batch_size`), so an interactive caller
+    gets the answer for a single line right away, while a fast producer
+    gets full batches. The output is flushed after each batch. Empty lines
+    get empty predictions.
+    """
+    lines_queue = queue.Queue(maxsize=options.dev_batch_size *
+                              options.queue_size)
+
+    def read_stage():
+        for line in iter(input_stream.readline, ''):
+            lines_queue.put(line.rstrip('\n'))
+        lines_queue.put(_END)
+
+    reader = threading.Thread(target=read_stage, name='read-stdin',
+                              daemon=True)
+    reader.start()
+
+    with writer.build(options, tags_field, None,
+                      stream=output_stream) as prediction_writer:
+        ended = False
+        while not ended:
+            lines = [lines_queue.get()]
+            while len(lines) < options.dev_batch_size:
+                try:
+                    lines.append(lines_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if lines[-1] is _END:
+                lines.pop()
+                ended = True
+            if not lines:
+                continue
+            predictions = predict_lines(options, fields_tuples, tags_field,
+                                        model, lines, prediction_cache)
+            predictions = cache.format_predictions(
+                predictions, prediction_writer.return_type)
+            prediction_writer.write(lines, predictions)
+            prediction_writer.flush()
+
+
+def predict_lines(options, fields_tuples, tags_field, model, lines,
+                  prediction_cache=None):
+    """Predict a list of sentences with tokens separated by spaces.
+
+    Returns:
+        list of np.ndarray: predictions for each line, which are empty for
+        empty lines
+    """
+    texts = [line for line in lines if line.strip()]
+    predictions = []
+    if texts:
+        text_dataset = dataset.build_texts(texts, fields_tuples, options)
+        predictions = predict_dataset(options, text_dataset, model,
+                                      prediction_cache)
+    if len(texts) == len(lines):
+        return predictions
+    if options.prediction_type == 'classes':
+        empty = np.zeros(0, dtype=np.int64)
     else:
-        logging.info(options.text)
-        logging.info(predictions_str)
+        empty = np.zeros((0, len(tags_field.vocab)), dtype=np.float32)
+    predictions = iter(predictions)
+    return [next(predictions) if line.strip() else empty for line in lines]
+
+
+def shard_offsets(path, nb_shards):
+    """Split a file into `nb_shards` contiguous byte ranges whose limits
+    are aligned to the beginning of a line."""
+    size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, nb_shards):
+            f.seek(max(size * i // nb_shards, offsets[-1]))
+            # move to the beginning of the next line
+            f.readline()
+            offsets.append(min(f.tell(), size))
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+# state inherited by the forked workers, so the model weights are shared
+# copy-on-write with the parent process instead of being pickled
+_worker_state = {}
+
+
+def predict_shards(options, fields_tuples, tags_field, model,
+                   prediction_cache=None):
+    shards = shard_offsets(options.test_path, options.num_workers)
+    shards_dirs = [str(Path(options.output_dir, 'shard-{}'.format(i)))
+                   for i in range(len(shards))]
+    nb_threads = max(1, torch.get_num_threads() // options.num_workers)
+    _worker_state.update(options=options,
+                         fields_tuples=fields_tuples,
+                         tags_field=tags_field,
+                         model=model,
+                         prediction_cache=prediction_cache)
+    context = multiprocessing.get_context('fork')
+    try:
+        with context.Pool(options.num_workers,
+                          initializer=torch.set_num_threads,
+                          initargs=(nb_threads,)) as pool:
+            cache_stats = pool.starmap(_predict_shard,
+                                       zip(shards, shards_dirs))
+    finally:
+        _worker_state.clear()
+
+    if prediction_cache is not None:
+        for hits, misses in cache_stats:
+            prediction_cache.hits += hits
+            prediction_cache.misses += misses
 
-    return predictions
+    # merge shards following the input order
+    writer.merge(options, shards_dirs, options.output_dir)
+    for shard_dir in shards_dirs:
+        shutil.rmtree(shard_dir)
+
+
+def _predict_shard(byte_range, shard_dir):
+    options = _worker_state['options']
+    tags_field = _worker_state['tags_field']
+    # sqlite connections can't be shared by forked processes
+    prediction_cache = _worker_state['prediction_cache']
+    if prediction_cache is not None:
+        prediction_cache = cache.PredictionCache(options.cache_dir,
+                                                 prediction_cache.model_hash,
+                                                 prediction_cache.nb_labels)
+    with writer.build(options, tags_field, shard_dir, is_shard=True) as w:
+        predict_file(options,
+                     _worker_state['fields_tuples'],
+                     _worker_state['model'],
+                     w,
+                     byte_range=byte_range,
+                     prediction_cache=prediction_cache)
+    if prediction_cache is None:
+        return 0, 0
+    prediction_cache.close()
+    return prediction_cache.hits, prediction_cache.misses
 
 
 def save_predictions(directory, predictions_str):
@@ -70,28 +431,3 @@ def save_predictions(directory, predictions_str):
     output_path = Path(directory, constants.PREDICTIONS)
     output_path.write_text(predictions_str)
     logging.info('Predictions saved in {}'.format(output_path))
-
-
-def transform_classes_to_tags(tags_field, predictions):
-    tagged_predicitons = []
-    for preds in predictions:
-        tags_preds = [tags_field.vocab.itos[c] for c in preds]
-        tagged_predicitons.append(tags_preds)
-    return tagged_predicitons
-
-
-def transform_predictions_to_text(predictions):
-    text = []
-    is_prob = isinstance(predictions[0][0], list)
-    for pred in predictions:
-        sentence = []
-        for p in pred:
-            if is_prob:
-                sentence.append(', '.join(['%.8f' % c for c in p]))
-            else:
-                sentence.append(p)
-        if is_prob:
-            text.append(' | '.join(sentence))
-        else:
-            text.append(' '.join(sentence))
-    return '\n'.join(text)
@@ -1,24 +1,64 @@
+import numpy as np
 import torch
 
-from deeptagger import constants
+from deeptagger.iterator import SortedIterator
 from deeptagger.models.utils import unmask
 
 
+def empty_predictions(pred_type, nb_classes):
+    """Flat predictions and offsets (see `Predicter.predict`) of an empty
+    list of sentences."""
+    if pred_type == 'classes':
+        flat = np.zeros(0, dtype=np.int64)
+    else:
+        flat = np.zeros((0, nb_classes), dtype=np.float32)
+    return flat, np.zeros(1, dtype=np.int64)
+
+
 class Predicter:
 
     def __init__(self, dataset_iter, model):
         self.dataset_iter = dataset_iter
         self.model = model
 
-    def predict(self, pred_type='classes'):
+    def predict(self, pred_type='classes', return_type='list'):
+        """Predict classes or probabilities for all batches.
+
+        If `return_type` is `list`, return a list with the predictions for
+        each sentence. If it is `numpy`, return the predictions of all
+        tokens in a single array of shape (nb_tokens,) for classes or
+        (nb_tokens, nb_classes) for probabilities, and an array with the
+        offsets where each sentence begins.
+        """
         self.model.eval()
         predictions = []
+        lengths = []
         with torch.no_grad():
             for batch in self.dataset_iter:
-                mask = batch.words != constants.PAD_ID
+                # predictions don't include <bos> and <eos> positions
+                mask = batch.words[:, 2:] != self.model.pad_id
                 if pred_type == 'classes':
-                    pred = unmask(self.model.predict_classes(batch), mask)
+                    pred = self.model.predict_classes(batch)
                 else:
-                    pred = unmask(self.model.predict_proba(batch), mask)
-                predictions.extend(pred)
+                    pred = self.model.predict_proba(batch)
+                if return_type == 'numpy':
+                    predictions.append(pred[mask].cpu().numpy())
+                    lengths.append(mask.int().sum(dim=-1).cpu().numpy())
+                else:
+                    predictions.extend(unmask(pred, mask))
+        if return_type == 'numpy':
+            return self._concat(predictions, lengths, pred_type)
+        if isinstance(self.dataset_iter, SortedIterator):
+            predictions = self.dataset_iter.restore_order(predictions)
         return predictions
+
+    def _concat(self, predictions, lengths, pred_type):
+        if not predictions:
+            return empty_predictions(pred_type, self.model.nb_classes)
+        flat = np.concatenate(predictions)
+        lengths = np.concatenate(lengths)
+        if isinstance(self.dataset_iter, SortedIterator):
+            return self.dataset_iter.restore_flat_order(flat, lengths)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return flat, offsets
@@ -0,0 +1,89 @@
+import logging
+import time
+from pathlib import Path
+
+import torch
+
+from deeptagger.dataset import dataset, fields
+from deeptagger import features
+from deeptagger import iterator
+from deeptagger import models
+from deeptagger import opts
+from deeptagger.stats import Stats
+
+
+def run(options):
+    if options.load is None:
+        raise Exception('You should inform a path to a trained model.')
+
+    if options.save is None:
+        raise Exception('You should inform a path to save the quantized '
+                        'model.')
+
+    if options.gpu_id is not None:
+        raise Exception('Quantized models can only be used on CPU.')
+
+    if options.dev_batch_size is None:
+        options.dev_batch_size = opts.DEFAULT_DEV_BATCH_SIZE
+
+    words_field = fields.WordsField()
+    tags_field = fields.TagsField()
+    fields_tuples = [('words', words_field), ('tags', tags_field)]
+    fields_tuples += features.load(options.load)
+
+    logging.info('Loading vocabularies...')
+    fields.load_vocabs(options.load, fields_tuples)
+
+    logging.info('Loading model...')
+    model = models.load(options.load, fields_tuples)
+
+    dev_iter = None
+    if options.dev_path is not None:
+        logging.info('Building dev dataset: {}'.format(options.dev_path))
+        dev_dataset = dataset.build(options.dev_path, fields_tuples, options)
+        logging.info('Building dev iterator...')
+        dev_iter = iterator.build(dev_dataset, options.gpu_id,
+                                  options.dev_batch_size, is_train=False)
+        logging.info('Evaluating float model...')
+        float_acc, float_time = evaluate(model, dev_iter)
+
+    logging.info('Quantizing model...')
+    model = models.quantize(model)
+
+    if dev_iter is not None:
+        logging.info('Evaluating quantized model...')
+        quant_acc, quant_time = evaluate(model, dev_iter)
+        logging.info('Float acc: {:.4f} ({:.2f}s)'.format(
+            float_acc, float_time))
+        logging.info('Quantized acc: {:.4f} ({:.2f}s)'.format(
+            quant_acc, quant_time))
+        logging.info('Acc difference: {:+.4f}'.format(quant_acc - float_acc))
+
+    logging.info('Saving path: {}'.format(options.save))
+    config_path = Path(options.save)
+    config_path.mkdir(parents=True, exist_ok=True)
+    logging.info('Saving config options...')
+    model_options = opts.load(options.load)
+    model_options.quantized = True
+    opts.save(config_path, model_options)
+    logging.info('Saving vocabularies...')
+    fields.save_vocabs(config_path, fields_tuples)
+    logging.info('Saving model...')
+    models.save(config_path, model)
+
+    return model
+
+
+def evaluate(model, dataset_iter):
+    """Return the accuracy of `model` on `dataset_iter` and the time spent
+    to predict all batches."""
+    stats = Stats(mask_id=model.tags_pad_id)
+    model.eval()
+    start_time = time.time()
+    with torch.no_grad():
+        for batch in dataset_iter:
+            pred = model(batch)
+            loss = model.loss(pred, batch.tags)
+            stats.update(loss.item(), pred, batch.tags)
+    elapsed = time.time() - start_time
+    return stats.get_acc(), elapsed
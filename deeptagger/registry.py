@@ -0,0 +1,248 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from deeptagger import config_utils
+from deeptagger import models
+from deeptagger.tagger import Tagger
+
+
+class LoadedTagger:
+    """A loaded tagger along with the size of its weights and the number of
+    predictions running on it."""
+
+    def __init__(self, tagger):
+        self.tagger = tagger
+        self.size = models.memory_size(tagger.model)
+        self.in_flight = 0
+        self._idle = threading.Condition()
+
+    def acquire(self):
+        with self._idle:
+            self.in_flight += 1
+
+    def release(self):
+        with self._idle:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._idle.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """Wait until no prediction is running on this tagger."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self.in_flight == 0, timeout)
+
+
+class TaggerRegistry:
+    """Hold several taggers in the same process.
+
+    Taggers are registered by name with the path of a saved model and they
+    are only loaded when first used. If `memory_budget` (in bytes) is set,
+    the least recently used taggers are unloaded whenever the weights of all
+    loaded taggers take more memory than the budget.
+
+    Each tagger keeps its own options, vocabularies and pad ids, so models
+    trained on different corpora can be used side by side. All methods are
+    thread-safe, and taggers can be replaced without downtime with `reload`.
+
+    Example:
+        registry = TaggerRegistry(memory_budget=2 * 1024**3)
+        registry.register('pt', 'path/to/pt-model/')
+        registry.register('en', 'path/to/en-model.dtb')
+        tags = registry.predict_classes('pt', 'Há livros na estante .')
+    """
+
+    def __init__(self, memory_budget=None, gpu_id=None):
+        self.memory_budget = memory_budget
+        self.gpu_id = gpu_id
+        # name -> (path, kwargs for Tagger.load)
+        self._paths = {}
+        # name -> LoadedTagger, in order of use (most recent last)
+        self._taggers = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def register(self, name, path, **load_kwargs):
+        """Register a model saved in `path` (directory or bundle). Extra
+        arguments are passed to `Tagger.load`, e.g. `quantize=True`. If a
+        tagger with the same name was loaded, it is unloaded."""
+        with self._lock:
+            self._paths[name] = (path, load_kwargs)
+            self._load_locks.setdefault(name, threading.Lock())
+            self._unload(name)
+
+    def unregister(self, name):
+        with self._lock:
+            self._unload(name)
+            del self._paths[name]
+            del self._load_locks[name]
+
+    def __contains__(self, name):
+        return name in self._paths
+
+    @property
+    def names(self):
+        return list(self._paths.keys())
+
+    @property
+    def loaded(self):
+        """Names of the loaded taggers, from the least to the most recently
+        used."""
+        with self._lock:
+            return list(self._taggers.keys())
+
+    @property
+    def memory_usage(self):
+        with self._lock:
+            return self._memory_usage()
+
+    def get(self, name):
+        """Return the tagger registered as `name`, loading it if needed."""
+        return self._get(name).tagger
+
+    @contextmanager
+    def use(self, name):
+        """Context manager that gives the tagger registered as `name`. While
+        it is in use, a `reload` waits for it before releasing the tagger.
+        """
+        loaded = self._get(name, acquire=True)
+        try:
+            yield loaded.tagger
+        finally:
+            loaded.release()
+
+    def _get(self, name, acquire=False):
+        # taggers are acquired while holding the registry lock, so a reload
+        # can't switch and drain them in between
+        with self._lock:
+            if name not in self._paths:
+                raise Exception('Tagger {} is not registered.'.format(name))
+            if name in self._taggers:
+                return self._use(name, acquire)
+            load_lock = self._load_locks[name]
+
+        # load outside of the registry lock, so other taggers can still be
+        # used, but only once for concurrent requests of the same tagger
+        with load_lock:
+            with self._lock:
+                if name in self._taggers:
+                    return self._use(name, acquire)
+                path, load_kwargs = self._paths[name]
+            loaded = LoadedTagger(self._load(name, path, load_kwargs))
+            with self._lock:
+                self._taggers[name] = loaded
+                self._evict(keep=name)
+                return self._use(name, acquire)
+
+    def _use(self, name, acquire):
+        loaded = self._taggers[name]
+        self._taggers.move_to_end(name)
+        if acquire:
+            loaded.acquire()
+        return loaded
+
+    def _load(self, name, path, load_kwargs):
+        logging.info('Loading tagger {} from {}'.format(name, path))
+        tagger = Tagger(gpu_id=self.gpu_id)
+        tagger.load(path, inference=True, **load_kwargs)
+        return tagger
+
+    def reload(self, name, path=None, warmup=True, wait=False,
+               **load_kwargs):
+        """Replace the tagger registered as `name` without downtime.
+
+        The new model is loaded from `path` (by default the registered one)
+        with the registered load options, updated by `load_kwargs`, in a
+        background thread and warmed up, while the current tagger keeps
+        answering. Then new requests are atomically switched to the new
+        tagger, and the old one is released after the predictions already
+        running on it have finished. If loading fails, the current tagger
+        is kept.
+
+        Returns:
+            concurrent.futures.Future: done when the old tagger is drained.
+                If `wait` is True, this method blocks until then.
+        """
+        with self._lock:
+            if name not in self._paths:
+                raise Exception('Tagger {} is not registered.'.format(name))
+            registered_path, registered_kwargs = self._paths[name]
+            if path is None:
+                path = registered_path
+            load_kwargs = dict(registered_kwargs, **load_kwargs)
+            load_lock = self._load_locks[name]
+
+        future = Future()
+
+        def reload_in_background():
+            try:
+                with load_lock:
+                    new = self._load(name, path, load_kwargs)
+                    if warmup:
+                        new.warmup()
+                    new = LoadedTagger(new)
+                    with self._lock:
+                        old = self._taggers.get(name)
+                        self._paths[name] = (path, load_kwargs)
+                        self._taggers[name] = new
+                        self._taggers.move_to_end(name)
+                        self._evict(keep=name)
+                logging.info('Tagger {} switched to {}'.format(name, path))
+                if old is not None:
+                    old.wait_idle()
+                    del old
+                    config_utils.empty_cache(self.gpu_id)
+                future.set_result(path)
+            except Exception as e:
+                logging.exception('Could not reload tagger {}'.format(name))
+                future.set_exception(e)
+
+        thread = threading.Thread(target=reload_in_background,
+                                  name='reload-{}'.format(name),
+                                  daemon=True)
+        thread.start()
+        if wait:
+            future.result()
+        return future
+
+    def unload(self, name):
+        with self._lock:
+            self._unload(name)
+
+    def predict(self, name, texts, **kwargs):
+        with self.use(name) as tagger:
+            return tagger.predict(texts, **kwargs)
+
+    def predict_classes(self, name, texts, **kwargs):
+        with self.use(name) as tagger:
+            return tagger.predict_classes(texts, **kwargs)
+
+    def predict_probas(self, name, texts, **kwargs):
+        with self.use(name) as tagger:
+            return tagger.predict_probas(texts, **kwargs)
+
+    def _memory_usage(self):
+        return sum(loaded.size for loaded in self._taggers.values())
+
+    def _unload(self, name):
+        # predictions running on the tagger hold their own reference to it,
+        # so they finish normally
+        self._taggers.pop(name, None)
+
+    def _evict(self, keep):
+        if self.memory_budget is None:
+            return
+        for name in list(self._taggers.keys()):
+            if self._memory_usage() <= self.memory_budget:
+                break
+            if name == keep:
+                continue
+            logging.info('Unloading tagger {} (least recently used)'.format(
+                name))
+            self._unload(name)
+        if self._memory_usage() > self.memory_budget:
+            logging.warning('Tagger {} alone takes more memory than the '
+                            'budget of {} bytes.'.format(keep,
+                                                         self.memory_budget))
@@ -4,15 +4,15 @@ import torch
 
 from deeptagger import constants
 from deeptagger import opts
-from deeptagger.modules.optim.lr_scheduler import FakeLR
+from deeptagger.lazy import LazyDict
 
 
-available_schedulers = {
-    None: FakeLR,
-    'step': torch.optim.lr_scheduler.StepLR,
-    'exponential': torch.optim.lr_scheduler.ExponentialLR,
-    'cosine-annealing': torch.optim.lr_scheduler.CosineAnnealingLR
-}
+available_schedulers = LazyDict({
+    None: 'deeptagger.modules.optim.lr_scheduler.FakeLR',
+    'step': 'torch.optim.lr_scheduler.StepLR',
+    'exponential': 'torch.optim.lr_scheduler.ExponentialLR',
+    'cosine-annealing': 'torch.optim.lr_scheduler.CosineAnnealingLR'
+})
 
 
 def build(options, optim):
@@ -38,8 +38,9 @@ def load_state(path, scheduler):
     scheduler.load_state_dict(torch.load(str(scheduler_path)))
 
 
-def load(path, optim):
-    options = opts.load(path)
+def load(path, optim, options=None):
+    if options is None:
+        options = opts.load(path)
     scheduler = build(options, optim)
     load_state(path, scheduler)
     return scheduler
@@ -18,15 +18,20 @@ class Stats(object):
     Args:
         train_vocab (dict): dict with words found in training data
         emb_vocab (dict): dict with words found in embeddings data
+        mask_id (int): id of the pad tag, ignored when computing stats.
+            Default is the id of the pad token in a vocabulary with the
+            default specials (see constants.py)
     """
-    def __init__(self, train_vocab=None, emb_vocab=None):
+    def __init__(self, train_vocab=None, emb_vocab=None, mask_id=None):
+        if mask_id is None:
+            mask_id = constants.PAD_ID
         if train_vocab is None:
             train_vocab = dict()
         if emb_vocab is None:
             emb_vocab = dict()
         self.train_vocab = train_vocab
         self.emb_vocab = emb_vocab
-        self.mask_id = constants.TAGS_PAD_ID
+        self.mask_id = mask_id
 
         # this attrs will be updated every time a new prediciton is added
         self.pred_classes = []
@@ -3,22 +3,51 @@ import numpy as np
 from argparse import Namespace
 from pathlib import Path
 
+from deeptagger import autotune
+from deeptagger import bundle
+from deeptagger import cache
 from deeptagger import config_utils
 from deeptagger.dataset import dataset, fields
+from deeptagger.dataset.corpus import Corpus
+from deeptagger.dataset import tokenizer
 from deeptagger import features
 from deeptagger import iterator
 from deeptagger import models
 from deeptagger import optimizer
 from deeptagger import scheduler
 from deeptagger import opts
-from deeptagger import train
-from deeptagger.predict import transform_classes_to_tags
-from deeptagger.predicter import Predicter
+from deeptagger.predicter import Predicter, empty_predictions
+from deeptagger.writer import transform_classes_to_tags
+
+DEFAULT_BATCH_SIZE = 32
 
 
 class Tagger:
+    """Train, load and use a PoS tagger.
+
+    Predictions are stateless, so a loaded tagger can be shared by many
+    threads calling `predict` at the same time, without duplicating the
+    weights. Use `num_threads` and `num_interop_threads` to control how many
+    threads torch uses for each op and for running independent ops (these
+    are process-wide settings, see `config_utils.configure_threads`).
+
+    If `cache_dir` is given, predictions are stored in a persistent cache
+    in that directory and sentences seen before (by the same model) are not
+    predicted again. See `cache.PredictionCache`.
 
-    def __init__(self, gpu_id=None):
+    If `memory_cache_size` is given, the predictions of the most recently
+    seen texts are also kept in memory (see `cache.LRUCache`), so frequent
+    queries are answered without running the model. Hits and misses are
+    counted in `tagger.memory_cache`. Both caches are invalidated when
+    another model is loaded, trained or quantized.
+
+    If the loaded model was autotuned (see `autotune.run`), its recommended
+    batch size and number of threads are used, unless `num_threads` is given.
+    """
+
+    def __init__(self, gpu_id=None, num_threads=None,
+                 num_interop_threads=None, cache_dir=None,
+                 memory_cache_size=None):
         words_field = fields.WordsField()
         tags_field = fields.TagsField()
         self.fields_tuples = [('words', words_field), ('tags', tags_field)]
@@ -28,43 +57,158 @@ class Tagger:
         self.optimizer = None
         self.scheduler = None
         self.gpu_id = gpu_id
+        self.num_threads = num_threads
+        self.batch_size = DEFAULT_BATCH_SIZE
+        self.autotune_config = None
+        self.cache_dir = cache_dir
+        self.cache = None
+        self.memory_cache = None
+        if memory_cache_size:
+            self.memory_cache = cache.LRUCache(memory_cache_size)
+        config_utils.configure_threads(num_threads, num_interop_threads)
+
+    def predict(self, texts, batch_size=None, prediction_type='classes',
+                return_type='list'):
+        """Predict classes or probabilities for a text or a list of texts.
 
-    def predict(self, texts, batch_size=32, prediction_type='classes'):
+        If `return_type` is `numpy`, the predictions of all tokens are
+        returned in a single array along with an array of offsets, where
+        the predictions for the text i are `flat[offsets[i]:offsets[i+1]]`.
+        See `Predicter.predict`.
+
+        By default, `batch_size` is the autotuned one or 32.
+        """
         if not self._loaded:
             raise Exception('You must load a trained model first.')
 
+        if batch_size is None:
+            batch_size = self.batch_size
+
+        # there are no batches to build the outputs from
+        if not isinstance(texts, str) and len(texts) == 0:
+            if return_type == 'numpy':
+                return empty_predictions(prediction_type,
+                                         self.model.nb_classes)
+            return []
+
+        if self.memory_cache is not None:
+            predictions = self._predict_memory_cached(texts, batch_size,
+                                                      prediction_type)
+            predictions = cache.format_predictions(predictions, return_type)
+        else:
+            predictions = self._predict(texts, batch_size, prediction_type,
+                                        return_type)
+
+        # return str if we received a str as input
+        if isinstance(texts, str) and return_type == 'list':
+            return predictions[0]
+
+        return predictions
+
+    def _predict(self, texts, batch_size, prediction_type, return_type):
         # remove tags from the list of fields
         f_tuples = list(filter(lambda x: x[0] != 'tags', self.fields_tuples))
 
         # build a dataset for a list of strings
         text_dataset = dataset.build_texts(texts, f_tuples, self.options)
 
-        # build a iterator for the new dataset
-        dataset_iter = iterator.build(text_dataset, self.gpu_id, batch_size, is_train=False)  # NOQA
+        if self.cache is not None:
+            # predict only the sentences missing from the cache
+            predictions = cache.predict(self.cache, text_dataset, self.model,
+                                        prediction_type, batch_size,
+                                        self.gpu_id)
+            predictions = cache.format_predictions(predictions, return_type)
+        else:
+            # build a iterator for the new dataset
+            dataset_iter = iterator.build_sorted(text_dataset, self.gpu_id, batch_size)  # NOQA
 
-        # create a Predicter for this dataset
-        predicter = Predicter(dataset_iter, self.model)
-        predictions = predicter.predict(prediction_type)
+            # create a Predicter for this dataset
+            predicter = Predicter(dataset_iter, self.model)
+            predictions = predicter.predict(prediction_type, return_type)
 
-        # return str if we received a str as input
-        if isinstance(texts, str):
-            return predictions[0]
+        return predictions
 
+    def _predict_memory_cached(self, texts, batch_size, prediction_type):
+        # returns a np.ndarray of predictions for each text
+        if isinstance(texts, str):
+            texts = [texts]
+        keys = [(prediction_type, Corpus._normalize(text)) for text in texts]
+        predictions = [self.memory_cache.get(key) for key in keys]
+        missing = {}
+        for key, text, pred in zip(keys, texts, predictions):
+            if pred is None and key not in missing:
+                missing[key] = text
+        if missing:
+            flat, offsets = self._predict(list(missing.values()), batch_size,
+                                          prediction_type, 'numpy')
+            new = dict(zip(missing.keys(), np.split(flat, offsets[1:-1])))
+            for key, pred in new.items():
+                # cached arrays are shared by all callers
+                pred.setflags(write=False)
+                self.memory_cache.put(key, pred)
+            predictions = [new[key] if pred is None else pred
+                           for key, pred in zip(keys, predictions)]
         return predictions
 
-    def predict_classes(self, texts, batch_size=32):
-        return self.predict(texts, batch_size, prediction_type='classes')
+    def warmup(self, batch_sizes=(1, 32), lengths=(8, 32, 128)):
+        """Run dummy batches with representative shapes through the model,
+        so that memory allocations and lazy initializations happen before
+        the first real request."""
+        if not self._loaded:
+            raise Exception('You must load a trained model first.')
+        words_vocab = self.fields_tuples[0][1].vocab
+        # any word works, but a known one goes through the same path as
+        # most real tokens
+        word = words_vocab.itos[-1]
+        for batch_size in batch_sizes:
+            for length in lengths:
+                texts = [' '.join([word] * length)] * batch_size
+                # skip the caches, so the model actually runs
+                self._predict(texts, batch_size, 'classes', 'list')
+
+    def predict_classes(self, texts, batch_size=None, return_type='list'):
+        return self.predict(texts, batch_size, prediction_type='classes',
+                            return_type=return_type)
+
+    def predict_probas(self, texts, batch_size=None, return_type='list'):
+        return self.predict(texts, batch_size, prediction_type='probas',
+                            return_type=return_type)
 
-    def predict_probas(self, texts, batch_size=32):
-        return self.predict(texts, batch_size, prediction_type='probas')
+    def tag_document(self, text, batch_size=None, max_length=200):
+        """Tag a raw text, which doesn't need to be tokenized nor split
+        into sentences (see `tokenizer.tokenize_document`).
+
+        All sentences are predicted at once in batches of similar lengths.
+
+        Returns:
+            list of sentences, where each sentence is a list of
+            (token, start, end, tag) tuples and `text[start:end] == token`
+        """
+        tokens, spans, offsets = tokenizer.tokenize_document(text, max_length)
+        if len(tokens) == 0:
+            return []
+        texts = tokenizer.join_sentences(tokens, offsets)
+        classes, _ = self.predict(texts, batch_size=batch_size,
+                                  return_type='numpy')
+        tags = self.transform_classes_to_tags(classes).tolist()
+        starts, ends = spans.T.tolist()
+        tagged = list(zip(tokens, starts, ends, tags))
+        return [tagged[start:end]
+                for start, end in zip(offsets[:-1], offsets[1:])]
 
     def transform_classes_to_tags(self, classes):
+        tags_field = self.fields_tuples[1][1]
+        # arrays of classes are mapped all at once
+        if isinstance(classes, np.ndarray):
+            itos = np.array(tags_field.vocab.itos, dtype=object)
+            return itos[classes]
         if isinstance(classes[0], int):
             return self.transform_classes_to_tags([classes])[0]
-        tags_field = self.fields_tuples[1][1]
         return transform_classes_to_tags(tags_field, classes)
 
     def transform_probas_to_tags(self, probas):
+        if isinstance(probas, np.ndarray):
+            return self.transform_classes_to_tags(np.argmax(probas, axis=-1))
         if isinstance(probas[0][0], float):
             return self.transform_probas_to_tags([probas])[0]
         classes = [np.argmax(probs, axis=-1).tolist() for probs in probas]
@@ -92,6 +236,7 @@ class Tagger:
         self.options = options
 
         # train!
+        from deeptagger import train
         fields_tuples, model, optimizer, scheduler = train.run(self.options)
         self.fields_tuples = fields_tuples
         self.model = model
@@ -100,27 +245,112 @@ class Tagger:
 
         # the tagger can be considered loaded
         self._loaded = True
+        self._model_changed()
+
+    def quantize(self):
+        self._quantize()
+        self._model_changed()
+
+    def _quantize(self):
+        if self.gpu_id is not None:
+            raise Exception('Quantized models can only be used on CPU.')
+        # quantized weights can't be trained, so we drop the optimizer
+        self.model = models.quantize(self.model)
+        self.options.quantized = True
+        self.optimizer = None
+        self.scheduler = None
 
-    def load(self, dir_path):
-        # load options from the json file
-        self.options = opts.load(dir_path)
+    def load(self, dir_path, quantize=False, inference=False,
+             use_autotune=True):
+        """Load a tagger saved in `dir_path`, which can be either a
+        directory created with `save` or a file created with
+        `save_bundle`.
 
-        # append loaded fields_tuples
-        self.fields_tuples += features.load(dir_path)
+        If `inference` is True, the optimizer and the scheduler are not
+        loaded, so the tagger can only be used for predicting. Bundles are
+        always loaded for inference.
 
-        # load vocabularies for each field
-        fields.load_vocabs(dir_path, self.fields_tuples)
+        If `use_autotune` is True and the model was autotuned, the
+        recommended batch size and number of threads are used.
+        """
+        if quantize and self.gpu_id is not None:
+            raise Exception('Quantized models can only be used on CPU.')
 
-        # set the current gpu
-        self.options.gpu_id = self.gpu_id
+        # drop the feature fields of a previously loaded model
+        self.fields_tuples = self.fields_tuples[:2]
+        if bundle.is_bundle(dir_path):
+            self.options, self.model = bundle.load(dir_path,
+                                                   self.fields_tuples,
+                                                   gpu_id=self.gpu_id)
+            inference = True
+        else:
+            # load options from the json file
+            self.options = opts.load(dir_path)
+
+            # set the current gpu
+            self.options.gpu_id = self.gpu_id
+
+            # append loaded fields_tuples
+            self.fields_tuples += features.build(self.options)
 
-        # load model, optimizer and scheduler
-        self.model = models.load(dir_path, self.fields_tuples)
-        self.optimizer = optimizer.load(dir_path, self.model.parameters())
-        self.scheduler = scheduler.load(dir_path, self.optimizer)
+            # load vocabularies for each field
+            fields.load_vocabs(dir_path, self.fields_tuples)
+
+            # load model
+            self.model = models.load(dir_path, self.fields_tuples,
+                                     self.options)
+
+        # load optimizer and scheduler
+        # (quantized models are saved without optimizer and scheduler)
+        quantized = getattr(self.options, 'quantized', False)
+        if not inference and not quantized:
+            self.optimizer = optimizer.load(dir_path,
+                                            self.model.parameters(),
+                                            self.options)
+            self.scheduler = scheduler.load(dir_path, self.optimizer,
+                                            self.options)
+        else:
+            # don't keep the ones of a previously loaded model
+            self.optimizer = None
+            self.scheduler = None
+
+        # quantize weights for a faster inference on CPU
+        if quantize and not quantized:
+            self._quantize()
+
+        # set eval mode once, so concurrent predictions only read the model
+        self.model.eval()
+
+        self.batch_size = DEFAULT_BATCH_SIZE
+        self.autotune_config = None
+        if use_autotune:
+            self.autotune_config = autotune.load_config(dir_path)
+        if self.autotune_config is not None:
+            self.batch_size = self.autotune_config['batch_size']
+            # the threads of a single worker (a `TaggerPool` gives them to
+            # each of its workers)
+            if self.num_threads is None:
+                config_utils.configure_threads(
+                    self.autotune_config['num_threads'])
 
         # now we have a loaded tagger
         self._loaded = True
+        self._model_changed()
+
+    def _model_changed(self):
+        # cached predictions are only valid for the model that made them
+        if self.memory_cache is not None:
+            self.memory_cache.clear()
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        if self.cache_dir is not None:
+            tags_field = self.fields_tuples[1][1]
+            self.cache = cache.PredictionCache(
+                self.cache_dir,
+                cache.model_hash(self.model, self.fields_tuples),
+                len(tags_field.vocab)
+            )
 
     def save(self, dir_path):
         dir_path = Path(dir_path)
@@ -128,5 +358,13 @@ class Tagger:
         opts.save(dir_path, self.options)
         fields.save_vocabs(dir_path, self.fields_tuples)
         models.save(dir_path, self.model)
-        optimizer.save(dir_path, self.optimizer)
-        scheduler.save(dir_path, self.scheduler)
+        if self.optimizer is not None:
+            optimizer.save(dir_path, self.optimizer)
+        if self.scheduler is not None:
+            scheduler.save(dir_path, self.scheduler)
+
+    def save_bundle(self, path):
+        """Save options, vocabularies and weights in a single file that can
+        be loaded with `load` for inference."""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        bundle.save(path, self.options, self.fields_tuples, self.model)
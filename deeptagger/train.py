@@ -12,6 +12,9 @@ from deeptagger.trainer import Trainer
 
 
 def run(options):
+    if options.dev_batch_size is None:
+        options.dev_batch_size = opts.DEFAULT_DEV_BATCH_SIZE
+
     words_field = fields.WordsField()
     tags_field = fields.TagsField()
     fields_tuples = [('words', words_field), ('tags', tags_field)]
@@ -44,9 +44,12 @@ class Trainer:
         self.final_report = options.final_report
         train_vocab = train_iter.dataset.fields['words'].vocab.orig_stoi
         emb_vocab = train_iter.dataset.fields['words'].vocab.vectors_words
-        self.train_stats = Stats(emb_vocab=emb_vocab)
-        self.dev_stats = Stats(train_vocab=train_vocab, emb_vocab=emb_vocab)
-        self.test_stats = Stats(train_vocab=train_vocab, emb_vocab=emb_vocab)
+        mask_id = model.tags_pad_id
+        self.train_stats = Stats(emb_vocab=emb_vocab, mask_id=mask_id)
+        self.dev_stats = Stats(train_vocab=train_vocab, emb_vocab=emb_vocab,
+                               mask_id=mask_id)
+        self.test_stats = Stats(train_vocab=train_vocab, emb_vocab=emb_vocab,
+                                mask_id=mask_id)
         self.reporter = Reporter(options.output_dir, options.tensorboard)
 
     def train(self):
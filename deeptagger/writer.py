@@ -0,0 +1,307 @@
+import shutil
+import struct
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+from deeptagger import constants
+from deeptagger.dataset.cleaner import Cleaner
+
+
+def transform_predictions(tags_field, predictions, prediction_type):
+    if prediction_type == 'classes':
+        return transform_classes_to_tags(tags_field, predictions)
+    return predictions
+
+
+def transform_classes_to_tags(tags_field, predictions):
+    tagged_predicitons = []
+    for preds in predictions:
+        tags_preds = [tags_field.vocab.itos[c] for c in preds]
+        tagged_predicitons.append(tags_preds)
+    return tagged_predicitons
+
+
+def transform_predictions_to_text(predictions):
+    text = []
+    # sentences can be empty in pipe mode
+    first = next((pred for pred in predictions if pred), [None])
+    is_prob = isinstance(first[0], list)
+    for pred in predictions:
+        sentence = []
+        for p in pred:
+            if is_prob:
+                sentence.append(', '.join(['%.8f' % c for c in p]))
+            else:
+                sentence.append(p)
+        if is_prob:
+            text.append(' | '.join(sentence))
+        else:
+            text.append(' '.join(sentence))
+    return '\n'.join(text)
+
+
+class TextWriter:
+    """Write one sentence per line. Tags are separated by a space and
+    probabilities are written as in `transform_predictions_to_text`.
+
+    If `stream` is given (e.g. sys.stdout), predictions are written to it
+    instead of a file in `directory`."""
+
+    filenames = [constants.PREDICTIONS]
+    # type of predictions received in `write` (see Predicter.predict)
+    return_type = 'list'
+
+    def __init__(self, directory, tags_field, options, stream=None):
+        self.tags_field = tags_field
+        self.prediction_type = options.prediction_type
+        self.stream = stream
+        if stream is not None:
+            self.file = stream
+            return
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.file = open(str(Path(directory, self.filenames[0])), 'w',
+                         encoding='utf8')
+
+    def write(self, lines, predictions):
+        predictions = transform_predictions(self.tags_field, predictions,
+                                            self.prediction_type)
+        self.file.write(transform_predictions_to_text(predictions))
+        self.file.write('\n')
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        # streams are owned by the caller
+        if self.stream is None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @classmethod
+    def merge(cls, directories, output_dir):
+        """Concatenate the files written in each directory following the
+        order of `directories`."""
+        for filename in cls.filenames:
+            with open(str(Path(output_dir, filename)), 'wb') as f:
+                for directory in directories:
+                    with open(str(Path(directory, filename)), 'rb') as f_in:
+                        shutil.copyfileobj(f_in, f)
+
+
+class TopKWriter(TextWriter):
+    """Write the `options.top_k` most probable tags of each token with their
+    probabilities, e.g. `N 0.9712, ADJ 0.0211 | V 0.9900, N 0.0031`."""
+
+    return_type = 'numpy'
+
+    def __init__(self, directory, tags_field, options, stream=None):
+        super().__init__(directory, tags_field, options, stream)
+        self.top_k = options.top_k
+        self.itos = np.array(tags_field.vocab.itos, dtype=object)
+
+    def write(self, lines, predictions):
+        probas, offsets = predictions
+        k = min(self.top_k, probas.shape[-1])
+        # (nb_tokens, nb_labels) -> (nb_tokens, k)
+        classes = np.argsort(-probas, axis=-1)[:, :k]
+        scores = np.take_along_axis(probas, classes, axis=-1)
+        tags = self.itos[classes]
+        tokens = [', '.join('{} {:.4f}'.format(t, s) for t, s in zip(*ts))
+                  for ts in zip(tags.tolist(), scores.tolist())]
+        text = [' | '.join(tokens[i:j])
+                for i, j in zip(offsets[:-1], offsets[1:])]
+        self.file.write('\n'.join(text))
+        self.file.write('\n')
+
+
+class ConllWriter(TextWriter):
+    """Write one token per line with the columns: index, word, tag and, if
+    probabilities are predicted, the probability of the tag. Sentences are
+    separated by an empty line."""
+
+    filenames = [constants.PREDICTIONS_CONLL]
+
+    def __init__(self, directory, tags_field, options, stream=None):
+        super().__init__(directory, tags_field, options, stream)
+        self.del_word = options.del_word
+        self.del_tag = options.del_tag
+        # lines read in pipe mode are not tagged
+        self.tagged = not options.pipe
+
+    def write(self, lines, predictions):
+        text = []
+        for line, pred in zip(lines, predictions):
+            line = Cleaner.trim(line.strip())
+            if self.tagged:
+                words = [token.rsplit(self.del_tag, 1)[0]
+                         for token in line.split(self.del_word)]
+            else:
+                words = line.split()
+            for i, (word, p) in enumerate(zip(words, pred), start=1):
+                if self.prediction_type == 'classes':
+                    tag = self.tags_field.vocab.itos[p]
+                    text.append('{}\t{}\t{}\n'.format(i, word, tag))
+                else:
+                    c = int(np.argmax(p))
+                    tag = self.tags_field.vocab.itos[c]
+                    text.append('{}\t{}\t{}\t{:.4f}\n'.format(i, word, tag,
+                                                              p[c]))
+            text.append('\n')
+        self.file.write(''.join(text))
+
+
+class NpyStream:
+    """Append rows to a .npy file without knowing its final shape. The header
+    is written with room to spare and it is rewritten when closing."""
+
+    header_size = 128
+
+    def __init__(self, path, dtype, row_shape=()):
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.nb_rows = 0
+        self.file = open(str(path), 'wb')
+        self.file.write(self._header())
+
+    def _header(self):
+        shape = (self.nb_rows,) + self.row_shape
+        header = "{{'descr': {!r}, 'fortran_order': False, 'shape': {!r}, }}"
+        header = header.format(self.dtype.str, shape)
+        # magic string (6) + version (2) + header length (2) + header
+        header = header.ljust(self.header_size - 10 - 1) + '\n'
+        return (b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) +
+                header.encode('latin1'))
+
+    def append(self, array):
+        array = np.ascontiguousarray(array, dtype=self.dtype)
+        self.file.write(array.tobytes())
+        self.nb_rows += len(array)
+
+    def close(self):
+        self.file.seek(0)
+        self.file.write(self._header())
+        self.file.close()
+
+
+class NpyWriter:
+    """Write all predictions as a flat array in `predictions.npy`, with shape
+    (nb_tokens,) for classes or (nb_tokens, nb_labels) for probabilities,
+    and the position where each sentence begins in `offsets.npy`, so that
+    sentence i is `predictions[offsets[i]:offsets[i+1]]`."""
+
+    filenames = [constants.PREDICTIONS_NPY, constants.OFFSETS_NPY]
+    return_type = 'numpy'
+
+    def __init__(self, directory, tags_field, options):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if options.prediction_type == 'classes':
+            self.dtype = np.int32
+            row_shape = ()
+        else:
+            self.dtype = np.dtype(options.probas_dtype)
+            row_shape = (len(tags_field.vocab),)
+        preds_path, offsets_path = self.paths(directory)
+        self.predictions = NpyStream(preds_path, self.dtype, row_shape)
+        self.offsets = NpyStream(offsets_path, np.int64)
+        self.offsets.append([0])
+
+    @classmethod
+    def paths(cls, directory):
+        return [Path(directory, filename) for filename in cls.filenames]
+
+    def write(self, lines, predictions):
+        flat, offsets = predictions
+        self.offsets.append(offsets[1:] + self.predictions.nb_rows)
+        self.predictions.append(flat)
+
+    def close(self):
+        self.predictions.close()
+        self.offsets.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @classmethod
+    def merge(cls, directories, output_dir, block_size=2**16):
+        preds_path, offsets_path = cls.paths(output_dir)
+        predictions = None
+        offsets = NpyStream(offsets_path, np.int64)
+        offsets.append([0])
+        for directory in directories:
+            shard_preds_path, shard_offsets_path = cls.paths(directory)
+            shard_preds = np.load(str(shard_preds_path), mmap_mode='r')
+            shard_offsets = np.load(str(shard_offsets_path))
+            if predictions is None:
+                predictions = NpyStream(preds_path, shard_preds.dtype,
+                                        shard_preds.shape[1:])
+            offsets.append(shard_offsets[1:] + predictions.nb_rows)
+            for i in range(0, len(shard_preds), block_size):
+                predictions.append(shard_preds[i:i + block_size])
+            del shard_preds
+        if predictions is not None:
+            predictions.close()
+        offsets.close()
+
+
+class NpzWriter(NpyWriter):
+    """Same as NpyWriter, but both arrays are packed in `predictions.npz`
+    (`np.load(path)['predictions']` and `np.load(path)['offsets']`)."""
+
+    def close(self):
+        super().close()
+        self.pack(self.directory)
+
+    @classmethod
+    def merge(cls, directories, output_dir, block_size=2**16):
+        super().merge(directories, output_dir, block_size=block_size)
+        cls.pack(output_dir)
+
+    @classmethod
+    def pack(cls, directory):
+        npz_path = Path(directory, constants.PREDICTIONS_NPZ)
+        # arrays are already compact, so we just store them
+        with zipfile.ZipFile(str(npz_path), 'w', zipfile.ZIP_STORED,
+                             allowZip64=True) as f:
+            for path in cls.paths(directory):
+                f.write(str(path), arcname=path.name)
+                path.unlink()
+
+
+available_writers = {
+    'text': TextWriter,
+    'topk': TopKWriter,
+    'conll': ConllWriter,
+    'npy': NpyWriter,
+    'npz': NpzWriter,
+}
+
+
+def build(options, tags_field, directory, is_shard=False, stream=None):
+    output_format = options.output_format
+    # npz files are packed only after merging all shards
+    if is_shard and output_format == 'npz':
+        output_format = 'npy'
+    writer_class = available_writers[output_format]
+    if stream is not None:
+        if not issubclass(writer_class, TextWriter):
+            raise Exception('The {} format can only be written to '
+                            'files.'.format(output_format))
+        return writer_class(directory, tags_field, options, stream=stream)
+    return writer_class(directory, tags_field, options)
+
+
+def merge(options, directories, output_dir):
+    writer_class = available_writers[options.output_format]
+    writer_class.merge(directories, output_dir)
@@ -0,0 +1,189 @@
+import itertools
+
+import pytest
+import torch
+
+from deeptagger.modules.crf import CRF
+
+NB_LABELS = 5
+BOS, EOS, PAD = 3, 4, 0
+
+
+def build_batch(lengths, seed=0, **kwargs):
+    torch.manual_seed(seed)
+    crf = CRF(NB_LABELS, BOS, EOS, pad_tag_id=PAD, **kwargs)
+    # bigger transitions than the default init, so paths really differ
+    crf.transitions.data += torch.randn(NB_LABELS, NB_LABELS)
+    emissions = torch.randn(len(lengths), max(lengths), NB_LABELS)
+    mask = torch.zeros(len(lengths), max(lengths))
+    for i, length in enumerate(lengths):
+        mask[i, :length] = 1
+    return crf, emissions, mask
+
+
+def path_score(crf, emissions, path):
+    trans = crf.transitions
+    score = trans[BOS, path[0]] + trans[path[-1], EOS]
+    for t, tag in enumerate(path):
+        score = score + emissions[t, tag]
+        if t > 0:
+            score = score + trans[path[t - 1], tag]
+    return score
+
+
+def all_paths(crf, emissions, length):
+    """Score of every path of a single sequence."""
+    paths = list(itertools.product(range(NB_LABELS), repeat=length))
+    scores = torch.stack([path_score(crf, emissions, p) for p in paths])
+    return paths, scores
+
+
+@pytest.mark.parametrize('scan_length', [None, 1])
+@pytest.mark.parametrize('lengths', [[1], [4, 2, 3, 1]])
+def test_log_likelihood(lengths, scan_length):
+    crf, emissions, mask = build_batch(lengths,
+                                       parallel_scan_length=scan_length)
+    tags = torch.randint(NB_LABELS, mask.shape)
+    scores = crf._compute_scores(emissions, tags, mask)
+    partition = crf._compute_log_partition(emissions, mask)
+    for i, length in enumerate(lengths):
+        gold = path_score(crf, emissions[i], tags[i, :length].tolist())
+        _, path_scores = all_paths(crf, emissions[i], length)
+        assert torch.allclose(scores[i], gold, atol=1e-4)
+        assert torch.allclose(partition[i], torch.logsumexp(path_scores, 0),
+                              atol=1e-4)
+
+
+@pytest.mark.parametrize('lengths', [[1], [4, 2, 3, 1]])
+def test_memory_efficient_log_partition(lengths):
+    crf, emissions, mask = build_batch(lengths)
+    efficient_crf = CRF(NB_LABELS, BOS, EOS, pad_tag_id=PAD,
+                        memory_efficient=True)
+    efficient_crf.load_state_dict(crf.state_dict())
+    tags = torch.randint(NB_LABELS, mask.shape)
+    grads = []
+    for model in [crf, efficient_crf]:
+        emissions.grad = None
+        emissions.requires_grad_()
+        nll = model(emissions, tags, mask=mask)
+        nll.backward()
+        grads.append((nll, emissions.grad, model.transitions.grad))
+    for expected, computed in zip(*grads):
+        assert torch.allclose(expected, computed, atol=1e-5)
+
+
+@pytest.mark.parametrize('lengths', [[1], [4, 2, 3, 1]])
+def test_marginals(lengths):
+    crf, emissions, mask = build_batch(lengths)
+    marginals = crf.marginals(emissions, mask=mask)
+    for i, length in enumerate(lengths):
+        paths, path_scores = all_paths(crf, emissions[i], length)
+        probas = torch.softmax(path_scores, 0)
+        expected = torch.zeros(max(lengths), NB_LABELS)
+        for path, proba in zip(paths, probas):
+            for t, tag in enumerate(path):
+                expected[t, tag] += proba
+        assert torch.allclose(marginals[i], expected, atol=1e-4)
+
+
+@pytest.mark.parametrize('scan_length', [None, 1])
+@pytest.mark.parametrize('lengths', [[1], [4, 2, 3, 1]])
+def test_viterbi_decode(lengths, scan_length):
+    crf, emissions, mask = build_batch(lengths,
+                                       parallel_scan_length=scan_length)
+    scores, tags, decoded_lengths = crf.decode(emissions, mask=mask)
+    assert tags.shape == mask.shape
+    assert decoded_lengths.tolist() == lengths
+    for i, length in enumerate(lengths):
+        paths, path_scores = all_paths(crf, emissions[i], length)
+        best = path_scores.argmax().item()
+        assert torch.allclose(scores[i], path_scores[best], atol=1e-4)
+        assert tags[i, :length].tolist() == list(paths[best])
+        assert (tags[i, length:] == PAD).all()
+
+
+def test_constrained_viterbi_decode():
+    lengths = [4, 2, 3, 1]
+    crf, emissions, mask = build_batch(lengths)
+    allowed_tags = torch.rand(emissions.shape) < 0.5
+    allowed_tags[:, :, 1] = True
+    _, tags, _ = crf.decode(emissions, mask=mask, allowed_tags=allowed_tags)
+    constrained = emissions.masked_fill(~allowed_tags, -10000.0)
+    _, expected, _ = crf.decode(constrained, mask=mask)
+    assert (tags == expected).all()
+    for i, length in enumerate(lengths):
+        positions = torch.arange(length)
+        assert allowed_tags[i, positions, tags[i, :length]].all()
+
+
+@pytest.mark.parametrize('k', [1, 3, 30])
+@pytest.mark.parametrize('lengths', [[1], [4, 2, 3, 1]])
+def test_kbest_viterbi_decode(lengths, k):
+    crf, emissions, mask = build_batch(lengths)
+    scores, tags, decoded_lengths = crf.decode_kbest(emissions, k, mask=mask)
+    assert tags.shape == (len(lengths), k, max(lengths))
+    assert decoded_lengths.tolist() == lengths
+    if k == 1:
+        best_scores, best_tags, _ = crf.decode(emissions, mask=mask)
+        assert torch.allclose(scores[:, 0], best_scores)
+        assert (tags[:, 0] == best_tags).all()
+    for i, length in enumerate(lengths):
+        paths, path_scores = all_paths(crf, emissions[i], length)
+        nb_paths = min(k, len(paths))
+        expected = path_scores.sort(descending=True)[0][:nb_paths]
+        assert torch.allclose(scores[i, :nb_paths], expected, atol=1e-4)
+        assert (scores[i, nb_paths:] == float('-inf')).all()
+        decoded = {tuple(tags[i, j, :length].tolist())
+                   for j in range(nb_paths)}
+        assert len(decoded) == nb_paths
+        for j in range(nb_paths):
+            path = tags[i, j, :length].tolist()
+            assert torch.allclose(scores[i, j],
+                                  path_score(crf, emissions[i], path),
+                                  atol=1e-4)
+        assert (tags[i, :, length:] == PAD).all()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3])
+def test_fixed_lag_decoder(chunk_size):
+    crf, emissions, mask = build_batch([10, 10])
+    _, expected, _ = crf.decode(emissions, mask=mask)
+
+    def decode_stream(lag):
+        decoder = crf.stream_decoder(lag)
+        tags = []
+        for i in range(0, emissions.shape[1], chunk_size):
+            tags.append(decoder.push(emissions[:, i:i + chunk_size]))
+            # tags are committed after lag positions
+            nb_pushed = min(i + chunk_size, emissions.shape[1])
+            assert sum(t.shape[1] for t in tags) == max(0, nb_pushed - lag)
+        tags.append(decoder.flush())
+        return torch.cat(tags, dim=1)
+
+    # without committing before the end, it is the usual viterbi
+    assert (decode_stream(lag=10) == expected).all()
+    # with lag=0 it is greedy
+    greedy = decode_stream(lag=0)
+    assert greedy.shape == expected.shape
+    alphas = crf.transitions[BOS] + emissions[:, 0]
+    assert (greedy[:, 0] == alphas.argmax(1)).all()
+
+
+def test_fixed_lag_decoder_long_stream():
+    crf, _, _ = build_batch([1])
+    emissions = torch.randn(2, 1000, NB_LABELS, requires_grad=True)
+    lag = 5
+    decoder = crf.stream_decoder(lag)
+    nb_committed = 0
+    for i in range(emissions.shape[1]):
+        nb_committed += decoder.push(emissions[:, i:i + 1]).shape[1]
+        # no graph is kept across pushes and memory stays bounded
+        assert not decoder.alphas.requires_grad
+        assert len(decoder.backpointers) <= lag
+    tags = decoder.flush()
+    assert not tags.requires_grad
+    assert nb_committed + tags.shape[1] == emissions.shape[1]
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-s'])
@@ -0,0 +1,52 @@
+import subprocess
+import sys
+
+import pytest
+
+# `-X importtime` and lazy package attributes (PEP 562) need python 3.7
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 7),
+                                reason='requires python 3.7')
+
+
+def imported_modules(statement):
+    """Run `statement` in a fresh interpreter with `-X importtime` and
+    return the list of all imported modules."""
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True
+    ).stderr
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        name = line[len('import time:'):].split('|')[2]
+        modules.append(name.strip())
+    return modules
+
+
+def test_import_package_is_lazy():
+    modules = imported_modules('import deeptagger')
+    assert 'deeptagger' in modules
+    assert 'torch' not in modules
+    assert 'torchtext' not in modules
+
+
+@pytest.mark.parametrize('module', ['deeptagger.predict', 'deeptagger.opts'])
+def test_import_predict_skips_training_modules(module):
+    modules = imported_modules('import {}'.format(module))
+    assert module in modules
+    training_modules = ['adabound',
+                        'deeptagger.train',
+                        'deeptagger.trainer',
+                        'deeptagger.dataset.vectors',
+                        'deeptagger.modules.optim.adamw',
+                        'deeptagger.models.cnn',
+                        'deeptagger.models.rcnn']
+    for name in training_modules:
+        assert name not in modules
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-s'])
@@ -0,0 +1,190 @@
+import copy
+import json
+import sys
+import threading
+
+import numpy as np
+import pytest
+import torch
+
+from deeptagger import autotune
+from deeptagger.dataset import dataset
+from deeptagger import iterator
+from deeptagger import predict
+from deeptagger import pool as pool_module
+from deeptagger.pool import TaggerPool
+from deeptagger.predicter import Predicter
+from deeptagger.registry import TaggerRegistry
+from deeptagger.tagger import Tagger
+
+SENTENCES = [
+    'o_ART gato_N come_V o_ART peixe_N ._PU',
+    'a_ART casa_N grande_ADJ tem_V uma_ART mesa_N ._PU',
+    'os_ART livros_N estão_V na_PREP estante_N ._PU',
+    'ele_PRON lê_V um_ART livro_N bonito_ADJ ._PU',
+]
+TEXTS = ['o gato lê um livro .', 'a mesa grande .', 'um peixe']
+
+
+def train_tagger(tmpdir):
+    train_path = tmpdir.join('train.txt')
+    train_path.write_text('\n'.join(SENTENCES * 10) + '\n', encoding='utf8')
+    # default options are parsed from the command line
+    argv = sys.argv
+    sys.argv = ['deeptagger']
+    try:
+        tagger = Tagger()
+        tagger.train(model='rnn',
+                     train_path=str(train_path),
+                     output_dir=str(tmpdir.join('runs')),
+                     epochs=1,
+                     hidden_size=[10],
+                     word_embeddings_size=10)
+    finally:
+        sys.argv = argv
+    return tagger
+
+
+@pytest.fixture(scope='module')
+def tagger(tmpdir_factory):
+    return train_tagger(tmpdir_factory.mktemp('tagger'))
+
+
+@pytest.mark.parametrize('prediction_type', ['classes', 'probas'])
+def test_predict_empty(tagger, prediction_type):
+    assert tagger.predict([], prediction_type=prediction_type) == []
+    flat, offsets = tagger.predict([], prediction_type=prediction_type,
+                                   return_type='numpy')
+    expected, _ = tagger.predict(TEXTS, prediction_type=prediction_type,
+                                 return_type='numpy')
+    assert flat.shape == (0,) + expected.shape[1:]
+    assert flat.dtype == expected.dtype
+    assert offsets.tolist() == [0]
+
+    # without any batch, the predicter also returns empty arrays
+    fields_tuples = [f for f in tagger.fields_tuples if f[0] != 'tags']
+    empty_dataset = dataset.build_texts([], fields_tuples, tagger.options)
+    dataset_iter = iterator.build_sorted(empty_dataset, None, 32)
+    predicter = Predicter(dataset_iter, tagger.model)
+    flat, offsets = predicter.predict(prediction_type, return_type='numpy')
+    assert flat.shape == (0,) + expected.shape[1:]
+    assert offsets.tolist() == [0]
+
+
+@pytest.mark.parametrize('prediction_type', ['classes', 'probas'])
+def test_pool_predict_empty(tagger, prediction_type):
+    with TaggerPool(tagger, num_workers=1, warmup=False) as pool:
+        assert pool.predict([], prediction_type=prediction_type) == []
+        flat, offsets = pool.predict([], prediction_type=prediction_type,
+                                     return_type='numpy')
+        expected, _ = pool.predict(TEXTS, prediction_type=prediction_type,
+                                   return_type='numpy')
+    assert flat.shape == (0,) + expected.shape[1:]
+    assert offsets.tolist() == [0]
+
+
+def worker_cache_is_inherited(key, parent_cache_id):
+    return id(pool_module._worker_state[key].cache) == parent_cache_id
+
+
+def test_pool_reopens_cache(tagger, tmpdir):
+    path = tmpdir.join('model.dtb')
+    tagger.save_bundle(str(path))
+    cached = Tagger(cache_dir=str(tmpdir.join('cache')))
+    cached.load(str(path))
+    expected = tagger.predict_classes(TEXTS)
+    with TaggerPool(cached, num_workers=2, warmup=False) as pool:
+        assert pool.predict_classes(TEXTS) == expected
+        # predicted again from the cache
+        assert pool.predict_classes(TEXTS) == expected
+        args = [(pool.key, id(cached.cache))] * 2
+        assert not any(pool.pool.starmap(worker_cache_is_inherited, args))
+    assert cached.predict_classes(TEXTS) == expected
+
+
+def test_bundle_round_trip(tagger, tmpdir):
+    path = tmpdir.join('model.dtb')
+    tagger.save_bundle(str(path))
+    loaded = Tagger()
+    loaded.load(str(path))
+    assert loaded.predict_classes(TEXTS) == tagger.predict_classes(TEXTS)
+    probas, offsets = tagger.predict_probas(TEXTS, return_type='numpy')
+    loaded_probas, loaded_offsets = loaded.predict_probas(TEXTS,
+                                                          return_type='numpy')
+    assert np.allclose(loaded_probas, probas)
+    assert np.array_equal(loaded_offsets, offsets)
+    # the weights are mapped from the bundle, with the same values
+    for name, tensor in tagger.model.state_dict().items():
+        assert loaded.model.state_dict()[name].equal(tensor)
+
+
+def test_load_bundle_drops_optimizer(tagger, tmpdir):
+    path = tmpdir.join('model.dtb')
+    tagger.save_bundle(str(path))
+    trained = train_tagger(tmpdir)
+    assert trained.optimizer is not None
+    # the optimizer of the trained model doesn't match the loaded one
+    trained.load(str(path))
+    assert trained.optimizer is None
+    assert trained.scheduler is None
+
+
+def test_registry_reload_keeps_load_options(tagger, tmpdir):
+    paths = [str(tmpdir.join('old.dtb')), str(tmpdir.join('new.dtb'))]
+    for path in paths:
+        tagger.save_bundle(path)
+    registry = TaggerRegistry()
+    registry.register('pt', paths[0], quantize=True)
+    registry.reload('pt', paths[1], warmup=False, wait=True)
+    with registry.use('pt') as loaded:
+        assert loaded.options.quantized
+
+
+def test_autotuned_threads(tagger, tmpdir):
+    path = str(tmpdir.join('model.dtb'))
+    tagger.save_bundle(path)
+    config = {'batch_size': 8, 'num_threads': 1, 'num_workers': 2}
+    with open(str(autotune.config_path(path)), 'w') as f:
+        json.dump(config, f)
+    parent_threads = torch.get_num_threads()
+    try:
+        torch.set_num_threads(4)
+        loaded = Tagger()
+        loaded.load(path)
+        # the threads of a single worker when predicting without a pool
+        assert torch.get_num_threads() == 1
+        assert loaded.batch_size == 8
+        with TaggerPool(loaded, warmup=False) as pool:
+            assert pool.num_workers == 2
+            assert pool.pool.apply(torch.get_num_threads) == 1
+    finally:
+        torch.set_num_threads(parent_threads)
+
+
+class FailingWriter:
+    return_type = 'list'
+
+    def write(self, chunk, predictions):
+        raise ValueError('disk full')
+
+
+def test_predict_file_stops_reader_on_error(tagger, tmpdir):
+    test_path = tmpdir.join('test.txt')
+    test_path.write_text('\n'.join(SENTENCES * 10) + '\n', encoding='utf8')
+    options = copy.copy(tagger.options)
+    options.test_path = str(test_path)
+    options.chunk_size = 1
+    options.queue_size = 1
+    options.dev_batch_size = 32
+    options.prediction_type = 'classes'
+    fields_tuples = [f for f in tagger.fields_tuples if f[0] != 'tags']
+    nb_threads = threading.active_count()
+    with pytest.raises(ValueError):
+        predict.predict_file(options, fields_tuples, tagger.model,
+                             FailingWriter())
+    # the reader is not left blocked on the full queue
+    assert threading.active_count() == nb_threads
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-s'])
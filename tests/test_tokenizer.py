@@ -0,0 +1,33 @@
+import pytest
+
+from deeptagger.dataset.tokenizer import join_sentences, tokenize_document
+
+
+def sentences(text):
+    tokens, spans, offsets = tokenize_document(text)
+    for token, (start, end) in zip(tokens, spans):
+        assert text[start:end] == token
+    return join_sentences(tokens, offsets)
+
+
+def test_sentence_ends():
+    text = 'O gato come. Ele dorme! "Onde?" perguntou ela.\n\nFim'
+    assert sentences(text) == ['O gato come .',
+                               'Ele dorme !',
+                               '" Onde ? " perguntou ela .',
+                               'Fim']
+
+
+def test_abbreviations_dont_end_sentences():
+    text = 'O Dr. Silva e a Sra. Souza chegaram. Mr. Smith met the U.S. ' \
+           'team. See vol. 3 of the book.'
+    assert sentences(text) == ['O Dr. Silva e a Sra. Souza chegaram .',
+                               'Mr. Smith met the U.S. team .',
+                               'See vol. 3 of the book .']
+    # words starting like an abbreviation still end sentences
+    assert sentences('Ele viu o Drama. Depois saiu.') == ['Ele viu o Drama .',
+                                                          'Depois saiu .']
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-s'])